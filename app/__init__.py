@@ -4,52 +4,83 @@
 # The init file is the FIRST THING THAT RUNS when we run our Flask app, so it's important to make sure that the init is basically the central hub of our app.
 # This means we need to have clear logic when we're creating these - organization is key!
 
+# Instead of building one global 'app' the moment this file is imported, we write an APPLICATION FACTORY - create_app()
+# `flask run` (FLASK_APP=app) and gunicorn ('app:create_app()') both know to call it for us
+# Because nothing happens at import time, a process only pays for the parts it actually asks for:
+# - only the blueprints listed in config.BLUEPRINTS get imported (a CLI command or an api-only worker can skip the rest)
+# - CORS is only set up when the api blueprint is there, request timing only with the metrics blueprint, and Flask-Migrate only when MIGRATE_ENABLED is on
+# benchmarks/bench_startup.py keeps an eye on how long all this takes
+
+from importlib import import_module
+
 from flask import Flask
 from config import Config
-from .api.routes import api
-from .site.routes import site
-from .authentication.routes import auth
 
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from models import db as root_db, login_manager, ma
-from flask_cors import CORS
-from helpers import JSONEncoder
+# Each blueprint lives in its own module - we locate the module and then look inside of it for the blueprint object
+# e.g. 'site' means: import app.site.routes and use the object called 'site' from it
+BLUEPRINT_MODULES = {
+    'site': ('.site.routes', 'site'),
+    'auth': ('.authentication.routes', 'auth'),
+    'api': ('.api.routes', 'api'),
+    'api_async': ('.api.async_routes', 'api_async'),
+    'metrics': ('.metrics.routes', 'metrics')
+}
+
+def create_app(config = Config):
+    app = Flask(__name__)
 
-# the period before site allows us to look around in our site folder - we locate the site folder that way and then we're looking inside of it for an object called 'site'
+    # We need to write the configuration first, so everything below can read it:
+    app.config.from_object(config)
 
-app = Flask(__name__)
+    # The caches and the password hasher are made from this app's config (see cache.py and hashing.py)
+    import cache, hashing
+    cache.init_app(app)
+    hashing.init_app(app)
 
-# CORS is used to avoid/combat Cross-Site Request Forgery, or CSRF, which is a common way hackers access our data
-CORS(app)
-# The above makes sure that Flask can run, but we haven't given it any data yet.
-# To do this, we're going to use our structure to: 
-# SEPARATE CONCERNS - this will mean that each folder and file will have a separate purpose
-# By separating things, you make it much easier to solve individual problems with different aspects of our code.
-# Part of the way we separate our concerns is with creating BLUEPRINTS in Flask
-# Much like we made blueprint-like objects in OOP, or how a function is a blueprint of a process until we call the function.
+    # The connection pool and SQLite settings come from the DB_* / SQLITE_* config (see dbpool.py)
+    from dbpool import engine_options
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {**engine_options(app.config), **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
 
-# Now let's register the blueprint - this comes with Flask and should already be pulled in
-# We'll tell it WHERE to register the blueprint to (app) and WHAT we're registering (the object which we imported)
+    # We need to initiate the database with the app and run the login manager:
+    from models import db as root_db, login_manager, ma
+    root_db.init_app(app)
+    from dbpool import init_engine
+    with app.app_context():
+        init_engine(root_db.engine, app.config)
+    login_manager.init_app(app)
+    ma.init_app(app)
 
-app.register_blueprint(site)
+    from helpers import FastJSONProvider
+    app.json = FastJSONProvider(app)
 
-# we will need some other data to talk to the browser before we can run the app, so we'll need to configure some settings for the browser and our command line interface to talk back and forth about what to expect from our app (this is done in config.py)
+    # Flask-Migrate is only needed for the `flask db ...` commands, and importing it pulls in alembic
+    if app.config['MIGRATE_ENABLED']:
+        from flask_migrate import Migrate
+        Migrate(app, root_db)
 
+    # Now let's register the blueprints - we tell Flask WHERE to register the blueprint to (app) and WHAT we're registering
+    # We SEPARATE CONCERNS this way: each blueprint is its own folder with its own routes (and templates)
+    for name in app.config['BLUEPRINTS']:
+        module_name, attribute = BLUEPRINT_MODULES[name]
+        app.register_blueprint(getattr(import_module(module_name, __name__), attribute))
 
-# We also need to connect the authentication content:
-app.register_blueprint(auth)
+    # Static file fingerprints and template precompiling (see pagecache.py) - after the blueprints, so their templates are found too
+    import pagecache
+    pagecache.init_app(app)
 
-# We need to connect the api content:
-app.register_blueprint(api)
+    # Timing for requests, SQL queries and templates, shown at /metrics
+    if 'metrics' in app.config['BLUEPRINTS']:
+        import metrics
+        metrics.init_app(app)
 
-app.json_encoder = JSONEncoder
+    # the in-memory search trie, for databases other than SQLite and Postgres (see search.py)
+    if 'api' in app.config['BLUEPRINTS']:
+        import search
+        search.init_app(app)
 
-# We need to write the configuration:
-app.config.from_object(Config)
+    # CORS lets a front end hosted somewhere else call our api from the browser
+    if {'api', 'api_async'} & set(app.config['BLUEPRINTS']):
+        from flask_cors import CORS
+        CORS(app)
 
-# We need to initiate the database with the app and run the login manager:
-root_db.init_app(app)
-login_manager.init_app(app)
-ma.init_app(app)
-migrate = Migrate(app, root_db)
\ No newline at end of file
+    return app
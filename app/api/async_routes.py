@@ -0,0 +1,155 @@
+# the async api tier serves the same contact reads as app/api/routes.py, but with 'async def' views on SQLAlchemy's async engine:
+# aiosqlite for a local SQLite file, asyncpg for Postgres (ASYNC_DATABASE_URI in config.py, worked out from DATABASE_URI if not set)
+# Under a WSGI server (gunicorn's sync or gthread workers) this does NOT free the request thread: the view awaits on the event loop,
+# but the WSGI thread that called it sits in EventLoopThread.run until the answer is back - one thread per request in flight, exactly
+# like the sync routes, so --threads still caps how many requests a worker serves at once
+# What changes is the database side: all those threads share one loop and its pool of connections, instead of each holding its own
+
+# It is OFF by default - add it with BLUEPRINTS=site,auth,api,api_async - because it needs an extra package: aiosqlite or asyncpg
+
+# Out of the box Flask runs every async view in a new event loop of its own, and an asyncpg/aiosqlite connection can't outlive its loop -
+# so every request would open a fresh connection (and rerun the SQLite pragmas). Instead, each worker process starts ONE event loop
+# in a background thread (EventLoopThread below) and every async view runs on it: the views of all request threads share that loop,
+# and the loop keeps a real pool of DB_POOL_SIZE connections open between requests
+# benchmarks/bench_async.py compares requests/second against the sync routes so you can decide with real numbers
+
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import threading
+import weakref
+from functools import wraps
+
+from flask import Blueprint, request, jsonify, current_app
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from cache import token_cache, MISSING
+from dbpool import apply_sqlite_pragmas, pool_pre_ping, sqlite_pragmas
+from helpers import request_token, token_matches, serialize_contact
+from models import User, Contact, contact_columns
+from .routes import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+api_async = Blueprint('api_async', __name__, url_prefix='/api/async')
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgres': 'postgresql+asyncpg',
+    'postgresql': 'postgresql+asyncpg'
+}
+
+# 'postgresql://user:pw@host/db' -> 'postgresql+asyncpg://user:pw@host/db'
+def async_database_uri(uri):
+    scheme, rest = uri.split('://', 1)
+    return ASYNC_DRIVERS.get(scheme.split('+')[0], scheme) + '://' + rest
+
+# one event loop per process, running forever in a daemon thread; a forked gunicorn worker starts its own the first time it needs it
+class EventLoopThread():
+    def __init__(self):
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def loop(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                threading.Thread(target = self._loop.run_forever, name = 'async-views', daemon = True).start()
+            return self._loop
+
+    # runs the coroutine on the loop and waits for it on the calling (request) thread
+    # the task is started inside a copy of the caller's context, so current_app, request and g work in the view
+    def run(self, coroutine):
+        loop = self.loop()
+        result = concurrent.futures.Future()
+
+        def copy_outcome(task):
+            if task.cancelled():
+                result.cancel()
+            elif task.exception() is not None:
+                result.set_exception(task.exception())
+            else:
+                result.set_result(task.result())
+
+        def start():
+            loop.create_task(coroutine).add_done_callback(copy_outcome)
+
+        loop.call_soon_threadsafe(start, context = contextvars.copy_context())
+        # the calling thread is blocked here until the view is done - the loop only shares the waiting on the database
+        return result.result()
+
+event_loop_thread = EventLoopThread()
+
+# Flask calls app.async_to_sync to turn each async view into something a WSGI thread can call - ours sends it to the shared loop
+@api_async.record_once
+def use_shared_event_loop(state):
+    state.app.async_to_sync = lambda function: lambda *args, **kwargs: event_loop_thread.run(function(*args, **kwargs))
+
+# the engines belong to the app (in app.extensions), one per database uri and event loop - a pool's connections can only be used on the loop that opened them
+def get_async_engine():
+    config = current_app.config
+    uri = config['ASYNC_DATABASE_URI'] or async_database_uri(config['SQLALCHEMY_DATABASE_URI'])
+    engines = current_app.extensions.setdefault('async_engines', weakref.WeakKeyDictionary()).setdefault(asyncio.get_running_loop(), {})
+    engine = engines.get(uri)
+    if engine is None:
+        engine = engines[uri] = make_async_engine(uri, config)
+    return engine
+
+def make_async_engine(uri, config):
+    engine = create_async_engine(
+        uri,
+        pool_size = config['DB_POOL_SIZE'],
+        max_overflow = config['DB_MAX_OVERFLOW'],
+        pool_timeout = config['DB_POOL_TIMEOUT'],
+        pool_recycle = config['DB_POOL_RECYCLE'],
+        pool_pre_ping = pool_pre_ping(config, uri)
+    )
+    if engine.dialect.name == 'sqlite':
+        pragmas = sqlite_pragmas(config)
+        event.listen(engine.sync_engine, 'connect', lambda dbapi_connection, record: apply_sqlite_pragmas(dbapi_connection, pragmas))
+    return engine
+
+# same rules as helpers.token_required (header, token_cache, constant-time compare, 401s), but the lookup on a cache miss is awaited
+# the view gets the cached snapshot of the user - it isn't attached to any session, which is fine for reading its columns
+def async_token_required(our_flask_function):
+    @wraps(our_flask_function)
+    async def decorated(*args, **kwargs):
+        token = request_token()
+        if not token:
+            return jsonify({'message': 'Token is missing.'}), 401
+
+        current_user_token = token_cache.get(token)
+        if current_user_token is MISSING:
+            async with get_async_engine().connect() as connection:
+                row = (await connection.execute(select(User.__table__).where(User.token == token))).first()
+            current_user_token = User.detached(row._mapping) if row else None
+            token_cache.set(token, current_user_token)
+
+        if not token_matches(token, current_user_token):
+            return jsonify({'message': 'Token is invalid'}), 401
+        return await our_flask_function(current_user_token, *args, **kwargs)
+    return decorated
+
+# keyset-paginated like GET /api/contacts, with the same ?after= and ?limit= and the same response
+@api_async.route('/contacts', methods = ['GET'])
+@async_token_required
+async def get_contacts(current_user_token):
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type = int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = request.args.get('after')
+
+    query = select(*contact_columns).where(Contact.user_token == current_user_token.token)
+    if after:
+        query = query.where(Contact.id > after)
+
+    async with get_async_engine().connect() as connection:
+        contacts = (await connection.execute(query.order_by(Contact.id).limit(limit + 1))).all()
+    has_more = len(contacts) > limit
+    contacts = contacts[:limit]
+
+    return jsonify({
+        'contacts': [serialize_contact(contact) for contact in contacts],
+        'next_cursor': contacts[-1].id if has_more else None
+    })
@@ -13,9 +13,323 @@
 
 # we also have a slightly different Blueprint instantiation - now we have 'url_prefix='/api' - this means that all API calls will have to have /api before we insert our slugs
 
-from flask import Blueprint, request, jsonify, render_template
-from helpers import token_required
-from models import db, User, Contact, contact_schema, contacts_schema
+import csv
+import io
+import json
+from datetime import datetime
+
+from flask import Blueprint, Response, request, jsonify, render_template, current_app, stream_with_context
+from marshmallow import EXCLUDE, ValidationError
+from dbpool import pool_report
+from helpers import token_required, operator_required, dumps, serialize_contact, make_etag, client_is_current, conditional, not_modified
+from models import db, User, Contact, ContactTombstone, CONTACT_FIELDS, contact_columns, contact_schema, normalize_phone, bump_phonebook_version
+from search import search_contacts, ensure_search_index
 
 api = Blueprint('api', __name__, url_prefix='/api')
 
+# Listing contacts uses KEYSET pagination instead of OFFSET
+# OFFSET makes the database read (and throw away) every row before the page we asked for, so page 1000 is much slower than page 1
+# with a keyset we remember the last id we sent (the 'cursor') and ask for ids greater than it, which the (user_token, id) index answers directly
+# clients pass ?after=<next_cursor> from the previous page, and ?limit= to choose the page size
+
+# Every page also carries an ETag built from the user's phonebook version (see bump_phonebook_version in models.py)
+# a client that sends it back in If-None-Match gets a 304 - and we answer that from the version alone, without reading any contacts
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# the version is read fresh on every request - the user in token_cache may be older than the last change
+def current_phonebook_version(user_token):
+    return db.session.query(User.phonebook_version).filter(User.token == user_token).scalar()
+
+@api.route('/contacts', methods = ['GET'])
+@token_required
+def get_contacts(current_user_token):
+    etag = make_etag(current_user_token.id, current_phonebook_version(current_user_token.token), request.query_string.decode())
+    if client_is_current(etag):
+        return not_modified(etag)
+
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type = int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = request.args.get('after')
+
+    query = db.session.query(*contact_columns).filter(Contact.user_token == current_user_token.token)
+    if after:
+        query = query.filter(Contact.id > after)
+
+# we ask for one extra row - if it comes back, we know there is another page without running a COUNT
+    contacts = query.order_by(Contact.id).limit(limit + 1).all()
+    has_more = len(contacts) > limit
+    contacts = contacts[:limit]
+
+    return conditional(jsonify({
+        'contacts': [serialize_contact(contact) for contact in contacts],
+        'next_cursor': contacts[-1].id if has_more else None
+    }), etag)
+
+# One contact, with an ETag from its version and a Last-Modified from updated_at
+@api.route('/contacts/<contact_id>', methods = ['GET'])
+@token_required
+def get_contact(current_user_token, contact_id):
+    contact = db.session.query(*contact_columns, Contact.version, Contact.updated_at) \
+        .filter(Contact.user_token == current_user_token.token, Contact.id == contact_id) \
+        .first()
+    if contact is None:
+        return jsonify({'message': 'Contact not found.'}), 404
+
+    etag = make_etag(contact.id, contact.version)
+    if client_is_current(etag, contact.updated_at):
+        return not_modified(etag, contact.updated_at)
+    return conditional(jsonify(serialize_contact(contact)), etag, contact.updated_at)
+
+# Delta sync: instead of downloading the whole phonebook again, a client asks for what changed since the version it last saw
+# ?since=<version> returns the contacts added/changed after it and the ids of contacts deleted after it (from their tombstones), oldest first
+# the answer's 'version' is what to send as ?since= next time; if 'has_more' is true, call again straight away for the rest
+
+DEFAULT_CHANGES_LIMIT = 500
+MAX_CHANGES_LIMIT = 5000
+
+@api.route('/contacts/changes', methods = ['GET'])
+@token_required
+def get_contact_changes(current_user_token):
+    since = request.args.get('since', 0, type = int)
+    limit = request.args.get('limit', DEFAULT_CHANGES_LIMIT, type = int)
+    limit = max(1, min(limit, MAX_CHANGES_LIMIT))
+
+    version = current_phonebook_version(current_user_token.token)
+    etag = make_etag(current_user_token.id, version, request.query_string.decode())
+    if client_is_current(etag):
+        return not_modified(etag)
+
+# every change has its own version number, so we take up to 'limit' of each kind, merge them in version order and keep the first 'limit'
+    changed = db.session.query(*contact_columns, Contact.version) \
+        .filter(Contact.user_token == current_user_token.token, Contact.version > since) \
+        .order_by(Contact.version).limit(limit + 1).all()
+    deleted = db.session.query(ContactTombstone.id, ContactTombstone.version) \
+        .filter(ContactTombstone.user_token == current_user_token.token, ContactTombstone.version > since) \
+        .order_by(ContactTombstone.version).limit(limit + 1).all()
+
+    changes = sorted([(row.version, 'changed', row) for row in changed] + [(row.version, 'deleted', row) for row in deleted], key = lambda change: change[0])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    return conditional(jsonify({
+        'version': changes[-1][0] if has_more else version,
+        'contacts': [serialize_contact(row) for change_version, kind, row in changes if kind == 'changed'],
+        'deleted': [row.id for change_version, kind, row in changes if kind == 'deleted'],
+        'has_more': has_more
+    }), etag)
+
+# Bulk import lets a new customer load tens of thousands of contacts in one request
+# Send the file as the request body with Content-Type text/csv (with a header row) or application/x-ndjson (one JSON object per line)
+# We never hold the whole upload in memory:
+# - the body is read line by line from request.stream by a generator
+# - each row is validated with ContactSchema, and good rows are collected into a batch
+# - every full batch is written with ONE executemany INSERT on the contact table, skipping the one-ORM-object-per-row path, then committed
+# So memory depends on the batch size (?batch_size=, default BULK_IMPORT_BATCH_SIZE), not on how big the file is
+
+MAX_BATCH_SIZE = 10000
+MAX_REPORTED_ERRORS = 100
+
+def read_jsonl_rows(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield None, {'_row': [f'Invalid JSON: {error}']}
+            continue
+        if not isinstance(row, dict):
+            yield None, {'_row': ['Each line must be a JSON object.']}
+            continue
+        yield row, None
+
+def read_csv_rows(lines):
+# empty CSV cells mean 'no value', not an empty string (an empty email would fail validation)
+    for row in csv.DictReader(lines):
+        yield {key: (value or None) for key, value in row.items() if key}, None
+
+@api.route('/contacts/bulk', methods = ['POST'])
+@token_required
+def bulk_import_contacts(current_user_token):
+    batch_size = request.args.get('batch_size', current_app.config['BULK_IMPORT_BATCH_SIZE'], type = int)
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+
+# bytes that aren't valid UTF-8 become U+FFFD instead of raising halfway through the upload - the row they're in is reported below
+    lines = (line.decode('utf-8-sig', errors = 'replace') for line in request.stream)
+    if request.mimetype in ('text/csv', 'application/csv'):
+        rows = read_csv_rows(lines)
+    elif request.mimetype in ('application/x-ndjson', 'application/jsonl', 'application/json-lines'):
+        rows = read_jsonl_rows(lines)
+    else:
+        return jsonify({'message': 'Send the contacts as text/csv or application/x-ndjson.'}), 415
+
+    contact_table = Contact.__table__
+# read the token once - committing a batch expires the user object, and touching it again would reload it
+    user_token = current_user_token.token
+    inserted = 0
+    failed = 0
+    errors = []
+# the batch holds (row number, row) pairs so a failed INSERT can still say which rows it lost
+    batch = []
+    errors_truncated = False
+
+    def report(row_number, messages):
+        nonlocal errors_truncated
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({'row': row_number, 'errors': messages})
+        else:
+            errors_truncated = True
+
+    def write(batch):
+        try:
+# the whole batch takes one block of phonebook versions, one number per contact
+            last_version = bump_phonebook_version(db.session.connection(), user_token, len(batch))
+            updated_at = datetime.utcnow()
+            for index, (row_number, row) in enumerate(batch):
+                row['version'] = last_version - len(batch) + 1 + index
+                row['updated_at'] = updated_at
+            db.session.execute(contact_table.insert(), [row for row_number, row in batch])
+            db.session.commit()
+            return len(batch), 0
+        except Exception as error:
+            db.session.rollback()
+            first_row, last_row = batch[0][0], batch[-1][0]
+            report(first_row, {'_batch': [f'Rows {first_row}-{last_row} were not saved: {error.__class__.__name__}']})
+            return 0, len(batch)
+
+    for row_number, (row, parse_errors) in enumerate(rows, start = 1):
+        if parse_errors is None and any(isinstance(value, str) and '\ufffd' in value for value in row.values()):
+            parse_errors = {'_row': ['Not valid UTF-8 text.']}
+        if parse_errors is None:
+            try:
+                row = contact_schema.load(row, unknown = EXCLUDE)
+            except ValidationError as error:
+                parse_errors = error.messages
+        if parse_errors is not None:
+            failed += 1
+            report(row_number, parse_errors)
+            continue
+
+# executemany needs every row to have the same keys, so fields left out of the upload become NULL
+        batch.append((row_number, {
+            'id': Contact.set_id(),
+            'name': row['name'],
+            'email': row.get('email'),
+            'phone_number': row.get('phone_number'),
+            'phone_digits': normalize_phone(row.get('phone_number')),
+            'address': row.get('address'),
+            'user_token': user_token
+        }))
+        if len(batch) >= batch_size:
+            ok, bad = write(batch)
+            inserted, failed = inserted + ok, failed + bad
+            batch = []
+
+    if batch:
+        ok, bad = write(batch)
+        inserted, failed = inserted + ok, failed + bad
+
+    return jsonify({
+        'inserted': inserted,
+        'failed': failed,
+        'errors': errors,
+        'errors_truncated': errors_truncated
+    })
+
+# Export streams a whole phonebook back out as JSON Lines, CSV or vCard (?format=jsonl|csv|vcf)
+# contacts_schema.dump() + jsonify would build every contact object, then every dict, then one giant string - all in memory at once
+# instead we:
+# - select plain column tuples (no ORM objects), in the same order as ContactSchema's fields
+# - use yield_per so the database driver hands rows over in batches (a server-side cursor on Postgres)
+# - turn each row straight into text with a small encoder function, without going through Marshmallow (serialize_contact in helpers.py)
+# - yield that text to a streaming Response, so only one batch is ever held in memory
+
+def encode_jsonl(rows):
+    for row in rows:
+        yield dumps(serialize_contact(row)) + '\n'
+
+def encode_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CONTACT_FIELDS)
+# the header goes out on its own, so an empty phonebook still exports a valid CSV file
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def vcard_escape(value):
+    return (value or '').replace('\\', '\\\\').replace('\n', '\\n').replace(',', '\\,').replace(';', '\\;')
+
+def encode_vcf(rows):
+    for id, name, email, phone_number, address in rows:
+        lines = ['BEGIN:VCARD', 'VERSION:3.0', f'UID:{id}', f'FN:{vcard_escape(name)}', f'N:{vcard_escape(name)};;;;']
+        if email:
+            lines.append(f'EMAIL:{vcard_escape(email)}')
+        if phone_number:
+            lines.append(f'TEL:{vcard_escape(phone_number)}')
+        if address:
+            lines.append(f'ADR:;;{vcard_escape(address)};;;;')
+        lines.append('END:VCARD')
+        yield '\r\n'.join(lines) + '\r\n'
+
+EXPORT_FORMATS = {
+    'jsonl': (encode_jsonl, 'application/x-ndjson'),
+    'csv': (encode_csv, 'text/csv'),
+    'vcf': (encode_vcf, 'text/vcard')
+}
+
+@api.route('/contacts/export', methods = ['GET'])
+@token_required
+def export_contacts(current_user_token):
+    format = request.args.get('format', 'jsonl')
+    if format not in EXPORT_FORMATS:
+        return jsonify({'message': f'Unknown format. Choose one of: {", ".join(EXPORT_FORMATS)}'}), 400
+    encode, mimetype = EXPORT_FORMATS[format]
+
+    rows = db.session.query(*contact_columns) \
+        .filter(Contact.user_token == current_user_token.token) \
+        .order_by(Contact.id) \
+        .yield_per(current_app.config['EXPORT_BATCH_SIZE'])
+
+    return Response(
+        stream_with_context(encode(rows)),
+        mimetype = mimetype,
+        headers = {'Content-Disposition': f'attachment; filename=contacts.{format}'}
+    )
+
+# Type-ahead search over name, email and phone number - see search.py for how each database indexes it
+# ?q= is the text typed so far, ?limit= how many matches to return
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+@api.route('/contacts/search', methods = ['GET'])
+@token_required
+def search(current_user_token):
+    limit = request.args.get('limit', DEFAULT_SEARCH_LIMIT, type = int)
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+    token = current_user_token.token
+    rows = search_contacts(token, request.args.get('q', ''), limit, current_phonebook_version(token))
+    return jsonify({'contacts': [serialize_contact(row) for row in rows]})
+
+# `flask api create-search-index` builds the search index ahead of time (e.g. right after `flask db upgrade`) instead of on the first search that needs it
+@api.cli.command('create-search-index')
+def create_search_index_command():
+    if ensure_search_index():
+        print('The contact search index is ready.')
+    else:
+        print('Could not create the contact search index - see the warning above. Search still works, without it.')
+
+# How the database connection pool is doing: saturation near 1.0 or a growing checkout wait means requests are queueing for connections
+# It describes the whole service rather than one phonebook, so like /metrics it takes the operator token, not a customer's
+@api.route('/pool-stats', methods = ['GET'])
+@operator_required
+def pool_stats():
+    return jsonify(pool_report(db.engine, current_app.config['DB_MAX_OVERFLOW']))
@@ -1,5 +1,6 @@
 from forms import UserLoginForm
-from models import User, db, check_password_hash
+from hashing import password_hasher, HashingBusy
+from models import User, db
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 
 # imports for flask login
@@ -16,8 +17,9 @@ auth = Blueprint('auth', __name__, template_folder='auth_templates')
 # we then use a try - except setup to handle any errors we get with the sign up process - if the database doesn't like what we give it, we will have an error
 # the if statement asks if the browser is trying to post data, then continues if the form is submitted
 # the data in the email variable - form.email.data - comes from the UserLoginForm class ('form' is the data from the class)
-# Password does the same thing, and then we print them both out
-# If a user creates an account, we should see that data show up in our CLI
+# Password does the same thing
+# We don't print them out - anything printed ends up in the server logs, and a password must never be written anywhere in plain text
+# (to see what the app is doing, use the /metrics endpoint - see metrics.py)
 
 # Next we add the user to the database with the db.session
 def signup():
@@ -27,7 +29,6 @@ def signup():
         if request.method == 'POST' and form.validate_on_submit():
             email = form.email.data
             password = form.password.data
-            print(email, password)
 
 # The 'user' variable is an instantiation of the User class from models.py 
 # it includes the data passed in on forms.py as part of its creation
@@ -47,6 +48,10 @@ def signup():
 # So as soon as we successfully submit our data, this function will send us back to the home page:
             return redirect(url_for('site.home'))
 
+# HashingBusy means too many passwords are already waiting to be hashed (see hashing.py) - we ask the browser to try again shortly
+    except HashingBusy:
+        return busy('sign_up.html', form)
+
 # Now we write the except statement after we have the return redirect (should be tabbed to the same space as the try)
 # the 'except' allows us to handle the problem if our users don't send good data to our database
 # also what takes care of things if our FlaskForms and wtforms fields throw errors - in case things aren't validated:
@@ -66,13 +71,20 @@ def signin():
         if request.method == 'POST' and form.validate_on_submit():
             email = form.email.data
             password = form.password.data
-            print(email,password)
 
 # logged_user variable will ask our User class to save the current user's name as a variable
 # if nothing comes back from our data, then that user doesn't exist
 # if the variable doesn't have any data stored to it, it will evaluate as falsy on the following line in the if statement, which will cause the else statement to run instead since our user isn't signed up for access to the content
             logged_user = User.query.filter(User.email == email).first()
-            if logged_user and check_password_hash(logged_user.password, password):
+            if logged_user and password_hasher.verify(logged_user.password, password):
+# if PASSWORD_HASH_METHOD has changed since this password was hashed, this is our chance to hash it again with the new settings - it's the only time we see the real password
+# if the hashing queue is full we just skip it and upgrade on a later sign in
+                if password_hasher.needs_rehash(logged_user.password):
+                    try:
+                        logged_user.password = logged_user.set_password(password)
+                        db.session.commit()
+                    except HashingBusy:
+                        pass
 # also have the login_user function that we brought in from the imports to actually log in our user, and hten it will redirect to our site.profile page
                 login_user(logged_user)
                 flash('You were successful in your initiation. Congratulations, and welcome to the Jedi Knights', 'auth-success')
@@ -81,10 +93,18 @@ def signin():
             else:
                 flash('You have failed in your attempt to access this content.', 'auth-failed')
                 return redirect(url_for('auth.signin'))
+    except HashingBusy:
+        return busy('sign_in.html', form)
     except:
         raise Exception('Invalid Form Data: Please Check your Form')
     return render_template('sign_in.html', form=form)
 
+# when the password hashing queue is full we show the same form again with a '503 Service Unavailable' status
+# Retry-After tells the browser (and any load balancer) how many seconds to wait before trying again
+def busy(template, form):
+    flash('We are handling a lot of sign ins right now. Please try again in a moment.', 'auth-failed')
+    return render_template(template, form=form), 503, {'Retry-After': '1'}
+
 # this function logs users out with the logout_user function and sends them back to the home page
 @auth.route('/logout')
 def logout():
@@ -0,0 +1,23 @@
+# the metrics blueprint only has one page: /metrics, which is read by Prometheus (or curl) rather than by people
+# everything that fills it in lives in metrics.py
+# It shows every endpoint's latency, the SQL statement mix and the cache sizes, so it is operator-only (see operator_required in helpers.py)
+# The blueprint is off unless BLUEPRINTS includes 'metrics', and the page answers 404 until OPERATOR_TOKEN is set
+# To let Prometheus read it, give it the token in the scrape job:
+#   scrape_configs:
+#     - job_name: phonebook
+#       authorization:
+#         credentials: <OPERATOR_TOKEN>
+#       static_configs:
+#         - targets: ['phonebook.internal:8000']
+
+from flask import Blueprint, Response
+
+from helpers import operator_required
+from metrics import registry
+
+metrics = Blueprint('metrics', __name__)
+
+@metrics.route('/metrics')
+@operator_required
+def show_metrics():
+    return Response(registry.render(), mimetype = 'text/plain; version=0.0.4')
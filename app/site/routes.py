@@ -2,7 +2,13 @@
 # We are making the idea of these things - when we run the app is when we actually instantiate these objects, but here they are just functions and templates
 # The Blueprint import allows us to use the templates and access the file structure around them
 
+import hashlib
+
 from flask import Blueprint, render_template
+from flask_login import current_user
+from markupsafe import Markup
+
+from pagecache import cache_page, cached_fragment
 
 site = Blueprint('site', __name__, template_folder='site_templates')
 
@@ -14,10 +20,21 @@ site = Blueprint('site', __name__, template_folder='site_templates')
 
 # To create our routes:
 
+# the home page is the same for every visitor, so it is rendered once and then served from the page cache (see pagecache.py)
 @site.route('/')
+@cache_page()
 def home():
   return render_template('index.html')
 
+# the profile details belong to one user, so they are cached per user - the version is a fingerprint of what they show,
+# so a new email gives a new version and a fresh render
+# the api token is left out of the cached fragment (profile.html renders it on every request): a cache may sit on disk (PAGE_CACHE_BACKEND=filesystem),
+# and a credential written there would outlive a token rotation until the entry expired
 @site.route('/profile')
 def profile():
-  return render_template('profile.html')
\ No newline at end of file
+  if not current_user.is_authenticated:
+    return render_template('profile.html', details=Markup(render_template('profile_details.html')))
+
+  version = hashlib.sha1(current_user.email.encode()).hexdigest()
+  details = cached_fragment('profile_details', current_user.id, version, lambda: render_template('profile_details.html'))
+  return render_template('profile.html', details=details), 200, {'Cache-Control': 'private, no-cache'}
@@ -0,0 +1,7 @@
+# Benchmarks for the phonebook service - run them from the project folder:
+#   python -m benchmarks.run            the full suite (seeds data, drives site/auth/api, saves JSON, compares to a baseline)
+#   python -m benchmarks.seed           just build a synthetic dataset
+#   python -m benchmarks.bench_json     JSON serialization microbenchmark
+#   python -m benchmarks.bench_startup  cold start budget check
+#   python -m benchmarks.bench_async    sync vs async contact listing over HTTP
+#   python -m benchmarks.bench_signin   sign-in throughput with the password hashing pool
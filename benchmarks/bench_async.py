@@ -0,0 +1,32 @@
+# Requests/second of the sync contact listing (/api/contacts) against the async one (/api/async/contacts)
+# Start the app first with the async tier enabled, e.g.
+#   BLUEPRINTS=site,auth,api,api_async gunicorn -w 4 --threads 8 'app:create_app()'
+# then point this at it with a real api token:
+#   python -m benchmarks.bench_async --base-url http://127.0.0.1:8000 --token <token> --concurrency 1000
+
+import argparse
+import json
+
+from benchmarks.http_load import run_load, summarize
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Compare the sync and async contact listing under load.')
+    parser.add_argument('--base-url', default = 'http://127.0.0.1:5000')
+    parser.add_argument('--token', required = True, help = 'api token of a user with contacts')
+    parser.add_argument('--concurrency', type = int, default = 1000, help = 'open connections')
+    parser.add_argument('--duration', type = float, default = 30, help = 'seconds per run')
+    parser.add_argument('--limit', type = int, default = 100, help = 'contacts per page')
+    args = parser.parse_args()
+
+    headers = {'x-access-token': f'Bearer {args.token}'}
+    results = {}
+    for name, path in [('sync', '/api/contacts'), ('async', '/api/async/contacts')]:
+        latencies, errors = run_load(f'{args.base_url}{path}?limit={args.limit}', headers, args.concurrency, args.duration)
+        results[name] = summarize(latencies, errors, args.duration)
+        print(f'{name:<6} {json.dumps(results[name])}')
+
+    if results['sync']['requests_per_second']:
+        print(f'async/sync throughput: {results["async"]["requests_per_second"] / results["sync"]["requests_per_second"]:.2f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# Compares how fast we can turn a page of contacts into a JSON response body:
+# - 'schema + JSONEncoder': the old path - contacts_schema.dump() on contact objects, then json.dumps with the JSONEncoder the app used to have
+# - 'row serializer + dumps': the new path - serialize_contact() on row tuples, then helpers.dumps (orjson when installed)
+#
+# python -m benchmarks.bench_json --contacts 1000 --repeat 20
+
+import argparse
+import decimal
+import json
+import timeit
+from types import SimpleNamespace
+
+from helpers import dumps, orjson, serialize_contact
+from models import CONTACT_FIELDS, contacts_schema
+
+# the encoder helpers.py used before FastJSONProvider, kept here as the baseline: Decimals become strings
+class JSONEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, decimal.Decimal):
+            return str(obj)
+        return super(JSONEncoder,self).default(obj)
+
+def make_rows(count):
+    return [
+        (f'id-{index}', f'Contact {index}', f'contact{index}@example.com', f'+1 555 {index:07d}', f'{index} Main Street')
+        for index in range(count)
+    ]
+
+def schema_path(objects):
+    return json.dumps(contacts_schema.dump(objects), cls = JSONEncoder)
+
+def row_path(rows):
+    return dumps([serialize_contact(row) for row in rows])
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--contacts', type = int, default = 1000, help = 'contacts per response')
+    parser.add_argument('--repeat', type = int, default = 20, help = 'timed runs per path (the best one is reported)')
+    args = parser.parse_args()
+
+    rows = make_rows(args.contacts)
+    objects = [SimpleNamespace(**dict(zip(CONTACT_FIELDS, row))) for row in rows]
+    assert json.loads(schema_path(objects)) == json.loads(row_path(rows))
+
+    print(f'{args.contacts} contacts per response, orjson {"installed" if orjson else "NOT installed"}')
+    results = {}
+    for name, function, data in [('schema + JSONEncoder', schema_path, objects), ('row serializer + dumps', row_path, rows)]:
+        best = min(timeit.repeat(lambda: function(data), number = 1, repeat = args.repeat))
+        results[name] = best
+        print(f'{name:<24} {best * 1000:9.3f} ms   {args.contacts / best:12,.0f} contacts/s')
+    print(f'speedup: {results["schema + JSONEncoder"] / results["row serializer + dumps"]:.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# Sign-in throughput under a burst of logins, against a throwaway SQLite database through the Flask test client
+# Run it twice to compare hashing inline against the process pool (see hashing.py):
+#   python -m benchmarks.bench_signin --workers 0
+#   python -m benchmarks.bench_signin --threads 32
+# It reports successful sign-ins per second, latency percentiles, and how many requests got a 503 from admission control
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks.http_load import summarize
+from benchmarks.seed import make_app, seed, user_email, user_password
+from config import Config
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Measure sign-in throughput.')
+    parser.add_argument('--users', type = int, default = 20)
+    parser.add_argument('--threads', type = int, default = 16, help = 'concurrent sign-ins')
+    parser.add_argument('--duration', type = float, default = 15, help = 'seconds')
+    parser.add_argument('--workers', type = int, default = Config.PASSWORD_HASH_WORKERS, help = 'hashing processes (0 = hash on the request thread)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        app = make_app('sqlite:///' + os.path.join(folder, 'bench.db'), PASSWORD_HASH_WORKERS = args.workers)
+        password_hasher = app.extensions['password_hasher']
+        seed(app, args.users, 0)
+
+        latencies, rejected, errors = [], [0], [0]
+        deadline = time.perf_counter() + args.duration
+
+        def sign_in_loop(thread_number):
+            client = app.test_client()
+            index = thread_number
+            while time.perf_counter() < deadline:
+                user = index % args.users
+                started = time.perf_counter()
+                response = client.post('/signin', data = {'email': user_email(user), 'password': user_password(user)})
+                if response.status_code == 302:
+                    latencies.append(time.perf_counter() - started)
+                elif response.status_code == 503:
+                    rejected[0] += 1
+                else:
+                    errors[0] += 1
+                client.get('/logout')
+                index += args.threads
+
+        threads = [threading.Thread(target = sign_in_loop, args = (number,)) for number in range(args.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    result = summarize(latencies, errors[0], args.duration)
+    result['rejected_503'] = rejected[0]
+    print(f'method {password_hasher.method}, hashing workers {password_hasher.workers}, {args.threads} threads')
+    for key, value in result.items():
+        print(f'  {key:<20} {value:.2f}' if isinstance(value, float) else f'  {key:<20} {value}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# Cold start check: how long a brand new Python process takes to import the app and run create_app()
+# It runs `python -X importtime` in a fresh subprocess (so nothing is already imported), adds up the import times,
+# prints the slowest imports, and compares the total with a baseline recorded on the same machine - exiting with status 1
+# when it grew by more than --tolerance, so it can fail a CI job
+#
+# python -m benchmarks.bench_startup --save-baseline      (record benchmarks/startup_baseline.json on the CI machine, from a clean checkout)
+# python -m benchmarks.bench_startup                      (check against it)
+# BLUEPRINTS=api python -m benchmarks.bench_startup --baseline api_startup.json --save-baseline     (an api-only worker gets its own baseline)
+# --budget-ms 800 checks a fixed number instead
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(benchmarks_dir, 'startup_baseline.json')
+
+STARTUP_CODE = 'from app import create_app; create_app()'
+project_dir = os.path.dirname(benchmarks_dir)
+
+def measure():
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_CODE],
+        cwd = project_dir, capture_output = True, text = True
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        sys.exit(f'create_app() failed:\n{result.stderr}')
+
+    # lines look like 'import time:       212 |        947 |   flask' - the cumulative time of the top level imports (no indent) adds up to the total
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative_us), int(self_us), name.rstrip()))
+    top_level_ms = sum(cumulative for cumulative, self_us, name in imports if not name.startswith('  ')) / 1000
+    return wall_ms, top_level_ms, imports
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Fail if importing the app and calling create_app() got slower than the recorded baseline.')
+    parser.add_argument('--baseline', default = DEFAULT_BASELINE, help = 'baseline JSON to compare against (or to write with --save-baseline)')
+    parser.add_argument('--tolerance', type = float, default = 0.20, help = 'allowed slowdown over the baseline')
+    parser.add_argument('--save-baseline', action = 'store_true', help = 'write this run as the new baseline instead of checking it')
+    parser.add_argument('--budget-ms', type = float, help = 'check against this fixed total import time instead of a baseline')
+    parser.add_argument('--runs', type = int, default = 5, help = 'fresh processes to start (the fastest one counts)')
+    parser.add_argument('--top', type = int, default = 15, help = 'how many of the slowest imports to list')
+    args = parser.parse_args()
+
+    runs = [measure() for run in range(args.runs)]
+    wall_ms, import_ms, imports = min(runs, key = lambda run: run[1])
+
+    print('slowest imports (self time):')
+    for cumulative, self_us, name in sorted(imports, reverse = True, key = lambda entry: entry[1])[:args.top]:
+        print(f'  {self_us / 1000:8.2f} ms  {name.strip()}')
+    print(f'import time {import_ms:.1f} ms, whole process {wall_ms:.1f} ms')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump({
+                'import_ms': import_ms,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'blueprints': os.environ.get('BLUEPRINTS')
+            }, file, indent = 2)
+        print(f'wrote {args.baseline}')
+        return
+
+    if args.budget_ms is not None:
+        budget_ms = args.budget_ms
+    else:
+        if not os.path.exists(args.baseline):
+            sys.exit(f'no baseline at {args.baseline} - record one on this machine with --save-baseline')
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get('python') != platform.python_version():
+            print(f'warning: the baseline was recorded with Python {baseline.get("python")}, this is {platform.python_version()}')
+        budget_ms = baseline['import_ms'] * (1 + args.tolerance)
+        print(f'baseline {baseline["import_ms"]:.1f} ms, change {import_ms / baseline["import_ms"] - 1:+.1%}')
+
+    if import_ms > budget_ms:
+        sys.exit(f'FAIL: cold start is {import_ms - budget_ms:.1f} ms over budget ({budget_ms:.0f} ms)')
+    print(f'OK (budget {budget_ms:.0f} ms)')
+
+if __name__ == '__main__':
+    main()
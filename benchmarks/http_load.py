@@ -0,0 +1,105 @@
+# A small HTTP load generator built only on asyncio, so it can hold open a thousand connections from one process
+# Each connection is a loop that sends a request, reads the whole response and sends the next one (keep-alive when the server allows it)
+# run_load() returns every request's latency plus the number of errors, for the benchmarks to turn into throughput and percentiles
+
+import asyncio
+import time
+from multiprocessing import Pool
+from urllib.parse import urlsplit
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('server closed the connection')
+    status = int(status_line.split()[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.read()
+        headers['connection'] = 'close'
+    return status, headers.get('connection', '').lower() != 'close'
+
+async def connection_loop(url, headers, deadline, latencies, errors):
+    parts = urlsplit(url)
+    path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+    request = (
+        f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: keep-alive\r\n'
+        + ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+        + '\r\n'
+    ).encode('latin-1')
+
+    writer = None
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+            writer.write(request)
+            await writer.drain()
+            status, keep_alive = await read_response(reader)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+            errors[0] += 1
+            if writer is not None:
+                writer.close()
+            writer = None
+            continue
+        if status >= 400:
+            errors[0] += 1
+        else:
+            latencies.append(time.perf_counter() - started)
+        if not keep_alive:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+async def run_load_async(url, headers, concurrency, duration):
+    latencies, errors = [], [0]
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*[connection_loop(url, headers, deadline, latencies, errors) for connection in range(concurrency)])
+    return latencies, errors[0]
+
+def run_load(url, headers = None, concurrency = 100, duration = 10.0):
+    return asyncio.run(run_load_async(url, headers or {}, concurrency, duration))
+
+# One Python process tops out at one CPU core, which can be slower than the server - so for heavy runs we start several
+# load processes, split the connections between them, and add their results together
+def run_load_in_process(arguments):
+    return run_load(*arguments)
+
+def run_load_multiprocess(url, headers = None, processes = 4, concurrency = 100, duration = 10.0):
+    shares = [concurrency // processes + (index < concurrency % processes) for index in range(processes)]
+    with Pool(processes) as pool:
+        results = pool.map(run_load_in_process, [(url, headers, share, duration) for share in shares if share])
+    latencies = [latency for process_latencies, errors in results for latency in process_latencies]
+    return latencies, sum(errors for process_latencies, errors in results)
+
+def summarize(latencies, errors, duration):
+    latencies = sorted(latencies)
+
+    def percentile(fraction):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000 if latencies else None
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_second': len(latencies) / duration,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99)
+    }
@@ -0,0 +1,197 @@
+# The benchmark suite: seeds a synthetic dataset, drives the site, auth and api endpoints, and saves the numbers as JSON
+# Every performance change should come with a before/after from this.
+#
+# In-process (Flask test client, no web server - measures the app code and the database):
+#   python -m benchmarks.run --users 5 --contacts 2000
+# Over HTTP against a running server, with several load processes (the server must use the same database the seed wrote to):
+#   python -m benchmarks.run --database sqlite:///bench.db --base-url http://127.0.0.1:8000 --processes 4 --concurrency 200 --server-pid <pid>
+#
+# Results go to benchmarks/results/<time>.json. --compare benchmarks/baseline.json prints the change per scenario and exits with 1
+# when throughput dropped or p99 latency grew by more than --tolerance; --save-baseline writes the run as the new baseline
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.http_load import run_load_multiprocess, summarize
+from benchmarks.seed import make_app, seed
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(benchmarks_dir, 'baseline.json')
+RESULTS_DIR = os.path.join(benchmarks_dir, 'results')
+
+# name, method, path, how to authenticate ('token', 'session' or None), request body
+# {contact} and {etag} are filled in from the seeded data before the run
+SCENARIOS = [
+    ('site.home', 'GET', '/', None, None),
+    ('site.profile', 'GET', '/profile', 'session', None),
+    ('auth.signin', 'POST', '/signin', None, 'credentials'),
+    ('api.contacts', 'GET', '/api/contacts?limit=100', 'token', None),
+    ('api.contacts_not_modified', 'GET', '/api/contacts?limit=100', 'token_etag', None),
+    ('api.contact', 'GET', '/api/contacts/{contact}', 'token', None),
+    ('api.search', 'GET', '/api/contacts/search?q=lov', 'token', None),
+    ('api.search_common', 'GET', '/api/contacts/search?q=example', 'token', None),
+    ('api.search_missing', 'GET', '/api/contacts/search?q=zzz', 'token', None),
+    ('api.search_phone', 'GET', '/api/contacts/search?q=555', 'token', None),
+    ('api.changes', 'GET', '/api/contacts/changes?since=0&limit=500', 'token', None),
+    ('api.export', 'GET', '/api/contacts/export?format=jsonl', 'token', None),
+]
+
+# the peak memory of a process is a high-water mark: it never goes down, so it can't be split up per scenario
+# we report it once per run - for the benchmark process itself (seeding included) in-process, or for the server (--server-pid) over HTTP
+def peak_rss_kb(pid = None):
+    if pid is None:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == 'darwin' else peak
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    return None
+
+def request_details(scenario, account, contact_id, etag):
+    name, method, path, auth, body = scenario
+    headers = {}
+    if auth in ('token', 'token_etag'):
+        headers['x-access-token'] = f'Bearer {account["token"]}'
+    if auth == 'token_etag':
+        headers['If-None-Match'] = etag
+    data = {'email': account['email'], 'password': account['password']} if body == 'credentials' else None
+    return method, path.format(contact = contact_id), headers, data
+
+def run_in_process(app, account, contact_id, etag, duration, warmup):
+    results = {}
+    for scenario in SCENARIOS:
+        method, path, headers, data = request_details(scenario, account, contact_id, etag)
+        client = app.test_client()
+        if scenario[3] == 'session':
+            client.post('/signin', data = {'email': account['email'], 'password': account['password']})
+
+        latencies, errors = [], 0
+        warmup_until = time.perf_counter() + warmup
+        while time.perf_counter() < warmup_until:
+            client.open(path, method = method, headers = headers, data = data)
+
+        started = time.perf_counter()
+        while time.perf_counter() - started < duration:
+            request_started = time.perf_counter()
+            response = client.open(path, method = method, headers = headers, data = data)
+            response.get_data()
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - request_started)
+
+        results[scenario[0]] = summarize(latencies, errors, time.perf_counter() - started)
+        print(f'{scenario[0]:<28} {format_result(results[scenario[0]])}', flush = True)
+    return results
+
+# over HTTP only GET scenarios are driven (the load generator doesn't send bodies or cookies)
+def run_over_http(base_url, account, contact_id, etag, duration, processes, concurrency):
+    results = {}
+    for scenario in SCENARIOS:
+        method, path, headers, data = request_details(scenario, account, contact_id, etag)
+        if method != 'GET' or scenario[3] == 'session':
+            continue
+        latencies, errors = run_load_multiprocess(base_url + path, headers, processes, concurrency, duration)
+        results[scenario[0]] = summarize(latencies, errors, duration)
+        print(f'{scenario[0]:<28} {format_result(results[scenario[0]])}', flush = True)
+    return results
+
+def format_result(result):
+    p = lambda value: f'{value:8.2f}' if value is not None else '       -'
+    return (f'{result["requests_per_second"]:9.1f} req/s  p50 {p(result["p50_ms"])} ms  p95 {p(result["p95_ms"])} ms  '
+            f'p99 {p(result["p99_ms"])} ms  errors {result["errors"]}')
+
+# a scenario regresses when its throughput fell, or its p99 rose, by more than the tolerance
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        throughput_change = result['requests_per_second'] / before['requests_per_second'] - 1 if before['requests_per_second'] else 0.0
+        p99_change = result['p99_ms'] / before['p99_ms'] - 1 if before.get('p99_ms') and result.get('p99_ms') else 0.0
+        flag = throughput_change < -tolerance or p99_change > tolerance
+        print(f'{name:<28} throughput {throughput_change:+7.1%}  p99 {p99_change:+7.1%}{"  REGRESSION" if flag else ""}')
+        if flag:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Run the phonebook benchmark suite.')
+    parser.add_argument('--database', help = 'database to seed and use (default: a temporary SQLite file)')
+    parser.add_argument('--users', type = int, default = 5)
+    parser.add_argument('--contacts', type = int, default = 2000, help = 'contacts per user')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--duration', type = float, default = 5, help = 'seconds per scenario')
+    parser.add_argument('--warmup', type = float, default = 1, help = 'seconds of unmeasured requests before each in-process scenario')
+    parser.add_argument('--base-url', help = 'drive a running server over HTTP instead of the test client')
+    parser.add_argument('--processes', type = int, default = os.cpu_count() or 1, help = 'load generator processes (HTTP mode)')
+    parser.add_argument('--concurrency', type = int, default = 100, help = 'open connections in total (HTTP mode)')
+    parser.add_argument('--server-pid', type = int, help = 'server process to read peak RSS from (HTTP mode, Linux)')
+    parser.add_argument('--output', help = 'where to write the results JSON')
+    parser.add_argument('--compare', nargs = '?', const = DEFAULT_BASELINE, help = 'baseline JSON to compare against')
+    parser.add_argument('--tolerance', type = float, default = 0.10, help = 'allowed slowdown before --compare fails')
+    parser.add_argument('--save-baseline', action = 'store_true', help = f'also write the results to {DEFAULT_BASELINE}')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        database = args.database or 'sqlite:///' + os.path.join(folder, 'bench.db')
+        app = make_app(database)
+        print(f'seeding {args.users} users x {args.contacts} contacts into {database}', flush = True)
+        accounts = seed(app, args.users, args.contacts, args.seed)
+        account = accounts[0]
+
+        client = app.test_client()
+        headers = {'x-access-token': f'Bearer {account["token"]}'}
+        first_page = client.get('/api/contacts?limit=100', headers = headers)
+        contact_id = first_page.get_json()['contacts'][0]['id'] if args.contacts else 'missing'
+        etag = first_page.headers.get('ETag', '')
+
+        if args.base_url:
+            scenarios = run_over_http(args.base_url.rstrip('/'), account, contact_id, etag, args.duration, args.processes, args.concurrency)
+        else:
+            scenarios = run_in_process(app, account, contact_id, etag, args.duration, args.warmup)
+
+    if args.base_url:
+        peak_rss = peak_rss_kb(args.server_pid) if args.server_pid else None
+    else:
+        peak_rss = peak_rss_kb()
+
+    results = {
+        'created': datetime.utcnow().isoformat() + 'Z',
+        'mode': 'http' if args.base_url else 'in-process',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'dataset': {'users': args.users, 'contacts_per_user': args.contacts, 'seed': args.seed},
+        'settings': {'duration': args.duration, 'processes': args.processes, 'concurrency': args.concurrency} if args.base_url else {'duration': args.duration},
+        'peak_rss_kb': peak_rss,
+        'scenarios': scenarios
+    }
+
+    print(f'peak RSS {peak_rss} kB' if peak_rss else 'peak RSS not measured (pass --server-pid)')
+    output = args.output or os.path.join(RESULTS_DIR, datetime.utcnow().strftime('%Y%m%dT%H%M%SZ') + '.json')
+    os.makedirs(os.path.dirname(output), exist_ok = True)
+    for path in [output] + ([DEFAULT_BASELINE] if args.save_baseline else []):
+        with open(path, 'w') as file:
+            json.dump(results, file, indent = 2)
+        print(f'wrote {path}')
+
+    if args.compare:
+        if not os.path.exists(args.compare):
+            sys.exit(f'no baseline at {args.compare} - create one with --save-baseline')
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(scenarios, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# Builds a synthetic phonebook dataset for the benchmarks: N users, each with M contacts, created through the User and Contact models
+# (so passwords are hashed, phone digits normalized and phonebook versions bumped exactly like in the real app)
+# The same --seed always gives the same names, emails and phone numbers, so runs can be compared
+#
+# python -m benchmarks.seed --database sqlite:///bench.db --users 10 --contacts 5000
+
+import argparse
+import json
+import random
+
+from app import create_app
+from config import Config
+from models import db, User, Contact
+
+FIRST_NAMES = ['Ada', 'Grace', 'Alan', 'Linus', 'Margaret', 'Dennis', 'Barbara', 'Ken', 'Frances', 'Edsger', 'Radia', 'Guido']
+LAST_NAMES = ['Lovelace', 'Hopper', 'Turing', 'Torvalds', 'Hamilton', 'Ritchie', 'Liskov', 'Thompson', 'Allen', 'Dijkstra', 'Perlman', 'Rossum']
+STREETS = ['Main Street', 'Oak Avenue', 'Pine Road', 'Maple Lane', 'Cedar Court', 'Elm Drive']
+PHONE_FORMATS = ['+1 ({area}) {prefix}-{line}', '{area}-{prefix}-{line}', '{area}.{prefix}.{line}', '1{area}{prefix}{line}']
+
+# the benchmark app: its own database, no CSRF tokens on the forms (the test client can't fetch them), and no Flask-Migrate
+# any other setting can be passed in too, e.g. make_app(uri, PASSWORD_HASH_WORKERS = 0, TOKEN_CACHE_SIZE = 0)
+def make_app(database_uri, **settings):
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_uri
+        SECRET_KEY = 'benchmark'
+        WTF_CSRF_ENABLED = False
+        MIGRATE_ENABLED = False
+    for name, value in settings.items():
+        setattr(BenchmarkConfig, name, value)
+    return create_app(BenchmarkConfig)
+
+def user_password(index):
+    return f'password{index}'
+
+def user_email(index):
+    return f'user{index}@example.com'
+
+def fake_contact(random_numbers):
+    first, last = random_numbers.choice(FIRST_NAMES), random_numbers.choice(LAST_NAMES)
+    phone = random_numbers.choice(PHONE_FORMATS).format(
+        area = random_numbers.randint(200, 999), prefix = random_numbers.randint(200, 999), line = f'{random_numbers.randint(0, 9999):04d}')
+    return {
+        'name': f'{first} {last}',
+        'email': f'{first}.{last}{random_numbers.randint(1, 99999)}@example.com'.lower(),
+        'phone_number': phone,
+        'address': f'{random_numbers.randint(1, 9999)} {random_numbers.choice(STREETS)}'
+    }
+
+# creates the tables and the data, and returns [{'email', 'password', 'token'}] for every user
+def seed(app, users, contacts, seed = 0, batch_size = 1000):
+    random_numbers = random.Random(seed)
+    accounts = []
+    with app.app_context():
+        db.create_all()
+        for index in range(users):
+            user = User(user_email(index), password = user_password(index))
+            db.session.add(user)
+            db.session.commit()
+            accounts.append({'email': user.email, 'password': user_password(index), 'token': user.token})
+
+            for start in range(0, contacts, batch_size):
+                for number in range(start, min(start + batch_size, contacts)):
+                    db.session.add(Contact(user_token = user.token, **fake_contact(random_numbers)))
+                db.session.commit()
+    return accounts
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Fill a database with synthetic users and contacts.')
+    parser.add_argument('--database', required = True, help = 'SQLALCHEMY_DATABASE_URI to fill, e.g. sqlite:///bench.db')
+    parser.add_argument('--users', type = int, default = 10)
+    parser.add_argument('--contacts', type = int, default = 1000, help = 'contacts per user')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    accounts = seed(make_app(args.database), args.users, args.contacts, args.seed)
+    print(json.dumps(accounts, indent = 2))
+
+if __name__ == '__main__':
+    main()
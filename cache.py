@@ -0,0 +1,173 @@
+# cache.py holds the small in-process caches our app keeps in front of the database
+# the database is the slowest thing we talk to on most requests, so if we can remember an answer for a little while we skip a round trip
+
+# A TTLCache is a dictionary with two extra rules:
+# 1. it only holds 'maxsize' entries - when it is full, the entry that was used least recently gets thrown out (LRU)
+# 2. every entry expires after 'ttl' seconds, so even if nobody invalidates it we never serve something too old
+
+# The cache lives inside one Python process - each gunicorn worker has its own copy
+# That's why the TTL matters: it bounds how stale a worker can be if another worker changed the data
+
+# Each app gets its own caches, sized from ITS config: create_app() calls init_app(app), which keeps them in app.extensions['caches']
+# token_cache, user_cache and page_cache at the bottom are proxies (like flask_login's current_user) - they stand for the caches of whichever app is handling the current request
+
+import hashlib
+import os
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+# MISSING lets us tell the difference between 'not in the cache' and 'cached as None' (we cache None on purpose for bad tokens)
+MISSING = object()
+
+class TTLCache():
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default = MISSING):
+        with self._lock:
+            entry = self._data.get(key, MISSING)
+            if entry is MISSING or entry[0] < time.monotonic():
+                if entry is not MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last = False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+# A FileSystemCache has the same get/set/delete/clear as TTLCache, but keeps every entry in a file inside 'directory'
+# so all the workers on a machine share it - point it at a directory in /dev/shm (memory, not disk) to share it at memory speed
+# Entries expire the same way; when there are more than 'maxsize' files, the least recently written ones are removed
+# It only stores text (the page cache keeps rendered HTML): a file is the expiry time on the first line and the value after it,
+# so reading an entry never runs anything - and the directory has to be ours alone, or somebody else could plant pages in it
+class FileSystemCache():
+    # how many sets between checks of how many files there are
+    PRUNE_EVERY = 100
+
+    def __init__(self, directory, maxsize, ttl):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._sets = 0
+        os.makedirs(directory, mode = 0o700, exist_ok = True)
+        check_private_directory(directory)
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def get(self, key, default = MISSING):
+        try:
+            with open(self.path(key), encoding = 'utf-8', newline = '') as file:
+                expires = float(file.readline())
+                value = file.read()
+        except (OSError, ValueError):
+            self.misses += 1
+            return default
+        if expires < time.time():
+            self.delete(key)
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    # written to a temporary file first and then renamed into place, so another worker never reads half an entry
+    def set(self, key, value):
+        if not isinstance(value, str):
+            raise TypeError(f'FileSystemCache only stores text, not {type(value).__name__}')
+        if self.maxsize <= 0:
+            return
+        handle, temporary = tempfile.mkstemp(dir = self.directory, prefix = '.tmp')
+        with os.fdopen(handle, 'w', encoding = 'utf-8', newline = '') as file:
+            file.write(f'{time.time() + self.ttl!r}\n')
+            file.write(value)
+        os.replace(temporary, self.path(key))
+        self._sets += 1
+        if self._sets % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.startswith('.tmp'):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        for modified, path in sorted(entries)[:max(len(entries) - self.maxsize, 0)]:
+            self.remove(path)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def delete(self, key):
+        self.remove(self.path(key))
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            self.remove(entry.path)
+
+    def __len__(self):
+        return sum(1 for entry in os.scandir(self.directory) if not entry.name.startswith('.tmp'))
+
+# a real directory (not a symlink to somewhere else), owned by the user we run as, that nobody else can write to or read
+def check_private_directory(directory):
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode):
+        raise RuntimeError(f'Cache directory {directory} is not a directory')
+    if hasattr(os, 'getuid') and (info.st_uid != os.getuid() or info.st_mode & 0o077):
+        raise RuntimeError(f'Cache directory {directory} must be owned by this user and closed to everybody else (chmod 700)')
+
+def make_cache(backend, maxsize, ttl, directory = None):
+    if backend == 'filesystem':
+        return FileSystemCache(directory, maxsize, ttl)
+    return TTLCache(maxsize, ttl)
+
+def init_app(app):
+    app.extensions['caches'] = {
+        # token -> User snapshot (or None for tokens that don't belong to anyone), used by helpers.token_required
+        'token': TTLCache(app.config['TOKEN_CACHE_SIZE'], app.config['TOKEN_CACHE_TTL']),
+        # user id -> User snapshot, used by models.load_user so Flask-Login doesn't query the database on every page view
+        'user': TTLCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL']),
+        # rendered pages and page fragments for the site blueprint (see pagecache.py) - in memory by default, or shared between workers with PAGE_CACHE_BACKEND=filesystem
+        'page': make_cache(app.config['PAGE_CACHE_BACKEND'], app.config['PAGE_CACHE_SIZE'], app.config['PAGE_CACHE_TTL'], app.config['PAGE_CACHE_DIR'])
+    }
+
+token_cache = LocalProxy(lambda: current_app.extensions['caches']['token'])
+user_cache = LocalProxy(lambda: current_app.extensions['caches']['user'])
+page_cache = LocalProxy(lambda: current_app.extensions['caches']['page'])
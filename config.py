@@ -8,12 +8,15 @@
 # first import os, which allows us to interface with the CLI and tell it commands
 import os
 
-# next: import functionality for loading a .env file, which is the other part of allowing our app to configure before it is run
-from dotenv import load_dotenv
-
 # then join the base directory (the line creating the basedir variable) and the .env file (the load_dotenv command takes care of this)
 basedir = os.path.abspath(os.path.dirname(__file__)) 
-load_dotenv(os.path.join(basedir, '.env'))
+
+# next: load the .env file, which is the other part of allowing our app to configure before it is run
+# a deployed worker that gets ALL of its settings from real environment variables can set FLASK_SKIP_DOTENV=1 to skip importing python-dotenv and reading the file
+# (the same switch, read the same way, that stops the flask command from loading .env)
+if os.environ.get('FLASK_SKIP_DOTENV', '').lower() in ('', '0', 'false', 'no'):
+  from dotenv import load_dotenv
+  load_dotenv(os.path.join(basedir, '.env'))
 
 class Config():
   '''
@@ -26,4 +29,78 @@ class Config():
   SECRET_KEY = os.environ.get('NOT_S0_SECRET_K3Y')
 
   SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI') or 'sqlite:///' + os.path.join(basedir, 'app.db')
-  SQLALCHEMY_TRACK_NOTIFICATIONS = False
\ No newline at end of file
+  SQLALCHEMY_TRACK_NOTIFICATIONS = False
+
+  # Connection pool and engine tuning - see dbpool.py for what each of these does
+  # create_app() turns them into SQLALCHEMY_ENGINE_OPTIONS; anything you put in SQLALCHEMY_ENGINE_OPTIONS yourself wins
+  DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+  DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+  DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+  DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+  # left unset, pre-ping is on for server databases and off for SQLite
+  DB_POOL_PRE_PING = os.environ['DB_POOL_PRE_PING'].lower() == 'true' if 'DB_POOL_PRE_PING' in os.environ else None
+  DB_STATEMENT_CACHE_SIZE = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 500))
+  SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+  SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+  SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+  SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+
+  # the database url for the async api tier (app/api/async_routes.py) - left empty, it is DATABASE_URI with the async driver swapped in
+  ASYNC_DATABASE_URI = os.environ.get('ASYNC_DATABASE_URI')
+
+  # which blueprints create_app registers (comma separated) - e.g. BLUEPRINTS=api for an api-only worker
+  # the metrics blueprint is opt-in: BLUEPRINTS=site,auth,api,metrics (and set OPERATOR_TOKEN, below)
+  BLUEPRINTS = [name.strip() for name in os.environ.get('BLUEPRINTS', 'site,auth,api').split(',') if name.strip()]
+  # Flask-Migrate is only needed to run `flask db ...`; workers can set MIGRATE_ENABLED=false to skip loading it
+  MIGRATE_ENABLED = os.environ.get('MIGRATE_ENABLED', 'true').lower() == 'true'
+
+  # /metrics and /api/pool-stats describe the whole service, so they are for operators and Prometheus only:
+  # callers send 'Authorization: Bearer <OPERATOR_TOKEN>', and while OPERATOR_TOKEN is empty those pages answer 404 to everybody
+  OPERATOR_TOKEN = os.environ.get('OPERATOR_TOKEN')
+
+  # Metrics - see metrics.py. Requests slower than SLOW_REQUEST_MS are counted, and with PROFILE_SLOW_REQUESTS=true
+  # a background thread samples request stacks every PROFILE_INTERVAL_MS so slow ones can be logged with what they were doing
+  SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 500))
+  PROFILE_SLOW_REQUESTS = os.environ.get('PROFILE_SLOW_REQUESTS', 'false').lower() == 'true'
+  PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+
+  # Password hashing - see hashing.py. The method must include its cost (iterations / scrypt parameters) so old hashes can be spotted and upgraded
+  PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+  PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+  # processes per worker that do the hashing (0 = hash on the request thread), how many hashes may wait before we answer 503, and how long one may take
+  # every gunicorn worker gets its own pool, so keep this small - (gunicorn workers x PASSWORD_HASH_WORKERS) should stay around the CPU count
+  PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', min(2, os.cpu_count() or 1)))
+  PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', PASSWORD_HASH_WORKERS * 4))
+  PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+
+  # how many api tokens each worker remembers, and for how many seconds (set the size to 0 to turn the cache off)
+  TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+  TOKEN_CACHE_TTL = float(os.environ.get('TOKEN_CACHE_TTL', 60))
+
+  # same idea for the logged in user that Flask-Login loads from the session cookie - kept short since it backs every page
+  USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+  USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 30))
+
+  # the in-memory search trie (search.py, only for databases other than SQLite and Postgres): how many users' tries each worker keeps, and for how many seconds
+  SEARCH_TRIE_USERS = int(os.environ.get('SEARCH_TRIE_USERS', 100))
+  SEARCH_TRIE_TTL = float(os.environ.get('SEARCH_TRIE_TTL', 300))
+
+  # Page caching for the site blueprint - see pagecache.py
+  # PAGE_CACHE_BACKEND is 'memory' (one LRU per worker) or 'filesystem' (shared by every worker through PAGE_CACHE_DIR - a directory under /dev/shm keeps it in memory)
+  # PAGE_CACHE_DIR must belong to the user the app runs as and be closed to everybody else - it is created that way if it doesn't exist
+  PAGE_CACHE_BACKEND = os.environ.get('PAGE_CACHE_BACKEND', 'memory')
+  PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR', os.path.join(basedir, 'page_cache'))
+  PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 1000))
+  PAGE_CACHE_TTL = float(os.environ.get('PAGE_CACHE_TTL', 300))
+  # how long browsers and proxies may keep a page for anonymous visitors (Cache-Control max-age, in seconds)
+  PAGE_CACHE_MAX_AGE = int(os.environ.get('PAGE_CACHE_MAX_AGE', 60))
+  # fingerprinted static files (url_for('static', ...) adds ?v=<hash of the file>) never change, so they can be kept for a year
+  STATIC_FINGERPRINT_MAX_AGE = int(os.environ.get('STATIC_FINGERPRINT_MAX_AGE', 365 * 24 * 60 * 60))
+  # compile every template when a web worker starts, instead of on the first request that uses it
+  # `flask ...` commands (db upgrade, create-search-index, flask run) skip it even when it is on - they never render most of the templates
+  PRECOMPILE_TEMPLATES = os.environ.get('PRECOMPILE_TEMPLATES', 'true').lower() == 'true'
+
+  # how many rows the bulk contact import writes per INSERT/commit
+  BULK_IMPORT_BATCH_SIZE = int(os.environ.get('BULK_IMPORT_BATCH_SIZE', 1000))
+  # how many rows the contact export fetches from the database cursor at a time
+  EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
\ No newline at end of file
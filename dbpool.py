@@ -0,0 +1,153 @@
+# dbpool.py is how we tune the connection to the database
+# Opening a database connection is slow, so SQLAlchemy keeps a POOL of open connections and lends them out to requests
+# Everything here is driven from the DB_* and SQLITE_* settings in config.py - create_app() turns them into SQLALCHEMY_ENGINE_OPTIONS with engine_options()
+
+# Postgres (or any server database): a QueuePool of DB_POOL_SIZE connections that can grow by DB_MAX_OVERFLOW when busy,
+# recycled after DB_POOL_RECYCLE seconds, and 'pre-pinged' so a connection the server has dropped is replaced instead of failing a request
+# (SQLite has no server that could drop the connection, so there pre-ping is off unless DB_POOL_PRE_PING turns it on - it would only add a round trip to every checkout)
+# SQLite: several gunicorn workers writing to one file will hit 'database is locked' with the defaults, so every new connection gets:
+# - journal_mode=WAL: readers don't block the writer and the writer doesn't block readers
+# - synchronous=NORMAL: safe with WAL, and far fewer fsyncs per commit
+# - busy_timeout: wait for a lock instead of failing straight away
+# - mmap_size: read the database through memory mapping instead of read() calls
+
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool, StaticPool
+
+# how many recent checkout waits we keep to work out percentiles
+RECENT_CHECKOUTS = 1024
+
+# PoolStats keeps track of how long requests wait to get a connection out of the pool
+class PoolStats():
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent = deque(maxlen = RECENT_CHECKOUTS)
+        self._lock = threading.Lock()
+
+    def record(self, wait, timed_out = False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.recent.append(wait)
+
+    def report(self):
+        with self._lock:
+            recent = sorted(self.recent)
+            checkouts, timeouts, total_wait, max_wait = self.checkouts, self.timeouts, self.total_wait, self.max_wait
+
+        def percentile(fraction):
+            return recent[min(len(recent) - 1, int(len(recent) * fraction))] * 1000 if recent else 0.0
+
+        return {
+            'checkouts': checkouts,
+            'timeouts': timeouts,
+            'mean_ms': total_wait / checkouts * 1000 if checkouts else 0.0,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+            'max_ms': max_wait * 1000
+        }
+
+# a QueuePool that times every checkout - including waiting for a free connection and opening a new one
+# every pool keeps its own stats, so two apps (or two engines) in one process don't mix their numbers
+# (engine.dispose() replaces the pool with a fresh one, and the stats start again from zero with it)
+class TimedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            self.stats.record(time.perf_counter() - started, timed_out = True)
+            raise
+        self.stats.record(time.perf_counter() - started)
+        return connection
+
+def engine_options(config):
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    options = {
+        # how many compiled SQL statements SQLAlchemy keeps, so it doesn't rebuild the SQL text for queries it has already seen
+        'query_cache_size': config['DB_STATEMENT_CACHE_SIZE'],
+        'pool_pre_ping': pool_pre_ping(config, uri)
+    }
+
+    if uri.startswith('sqlite'):
+        options['connect_args'] = {
+            'timeout': config['SQLITE_BUSY_TIMEOUT'] / 1000,
+            'check_same_thread': False,
+            # the sqlite3 module's own prepared statement cache, per connection
+            'cached_statements': config['DB_STATEMENT_CACHE_SIZE']
+        }
+        # an in-memory database only exists inside its one connection, so every checkout has to share it
+        if uri in ('sqlite://', 'sqlite:///:memory:'):
+            options['poolclass'] = StaticPool
+            return options
+
+    options.update({
+        'poolclass': TimedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE']
+    })
+    return options
+
+def pool_pre_ping(config, uri):
+    if config['DB_POOL_PRE_PING'] is None:
+        return not uri.startswith('sqlite')
+    return config['DB_POOL_PRE_PING']
+
+def sqlite_pragmas(config):
+    return {
+        'journal_mode': config['SQLITE_JOURNAL_MODE'],
+        'synchronous': config['SQLITE_SYNCHRONOUS'],
+        'busy_timeout': config['SQLITE_BUSY_TIMEOUT'],
+        'mmap_size': config['SQLITE_MMAP_SIZE']
+    }
+
+# the pragmas are attached to ONE engine, with the values from its own app's config - two apps in one process don't share them
+# create_app() calls this for the app's engine; it does nothing for databases other than SQLite
+def init_engine(engine, config):
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(config)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        apply_sqlite_pragmas(dbapi_connection, pragmas)
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
+# what the /api/pool-stats endpoint shows: how full the pool is right now, and how long checkouts have been taking
+# (only a TimedQueuePool times its checkouts - any other pool reports zero waits)
+def pool_report(engine, max_overflow):
+    pool = engine.pool
+    report = {'pool': type(pool).__name__, 'status': pool.status()}
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + max(max_overflow, 0)
+        report.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow(),
+            'saturation': pool.checkedout() / capacity if capacity else 1.0
+        })
+    report['checkout_wait'] = getattr(pool, 'stats', PoolStats()).report()
+    return report
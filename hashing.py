@@ -0,0 +1,104 @@
+# hashing.py turns passwords into hashes (sign up) and checks passwords against hashes (sign in)
+# Password hashing is SLOW ON PURPOSE, so stolen hashes are expensive to crack - but that also means a burst of logins can hog the CPU
+# Python threads can't run Python code at the same time (the GIL), so hashing on the request thread stalls every other request in the worker
+# Instead we send the work to a pool of separate PROCESSES (PASSWORD_HASH_WORKERS, 0 means hash inline like before)
+# and only let PASSWORD_HASH_MAX_PENDING hashes queue up - past that we raise HashingBusy right away and the route answers 503,
+# which is better than making everybody wait
+
+# The method and cost come from PASSWORD_HASH_METHOD, e.g. 'pbkdf2:sha256:600000' or 'scrypt:32768:8:1'
+# Werkzeug writes the method at the front of every hash, so when the setting changes we can spot old hashes (needs_rehash)
+# and re-hash the password the next time that user signs in successfully
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from flask import current_app
+from werkzeug.local import LocalProxy
+from werkzeug.security import generate_password_hash, check_password_hash
+
+class HashingBusy(Exception):
+    pass
+
+class PasswordHasher():
+    def __init__(self, method, salt_length, workers, max_pending, timeout):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    # gunicorn forks its workers after importing the app, and a process pool can't be shared across a fork - so each process makes its own
+    # The hashing processes are NOT forked from the worker: a fork copies the worker's threads' locks in whatever state they are in
+    # (the page cache, the profiler, the async loop...) and can deadlock the child - forkserver (or spawn, where there is no forkserver)
+    # starts them from a clean process instead
+    def executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers = self.workers, mp_context = hashing_context())
+                self._pid = os.getpid()
+            return self._executor
+
+    def run(self, function, *args):
+        if self.workers <= 0:
+            return function(*args)
+        if not self._slots.acquire(blocking = False):
+            raise HashingBusy()
+        try:
+            future = self.executor().submit(function, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # the slot is given back when the job is really finished (or cancelled) - not when we stop waiting for it -
+        # so jobs we gave up on still count against PASSWORD_HASH_MAX_PENDING while they sit in the queue
+        future.add_done_callback(lambda future: self._slots.release())
+        try:
+            return future.result(timeout = self.timeout)
+        except TimeoutError:
+            # a job that hasn't started yet is taken out of the queue; one that is running can't be stopped and finishes on its own
+            future.cancel()
+            raise HashingBusy()
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pw_hash, password):
+        return self.run(check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        return not pw_hash.startswith(self.method + '$')
+
+def hashing_context():
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+# needs_rehash compares the start of the hash with the method, so the method has to be spelled the way Werkzeug writes it -
+# with every cost parameter. 'pbkdf2' or 'scrypt' on their own would be stored as 'pbkdf2:sha256:600000' and never match,
+# re-hashing every password on every sign in, so we refuse to start with them
+def check_method(method):
+    name, *costs = method.split(':')
+    if name == 'pbkdf2':
+        complete = len(costs) == 2 and costs[1].isdigit()
+    elif name == 'scrypt':
+        complete = len(costs) == 3 and all(cost.isdigit() for cost in costs)
+    else:
+        complete = False
+    if not complete:
+        raise ValueError(f"PASSWORD_HASH_METHOD must include its cost, e.g. 'pbkdf2:sha256:600000' or 'scrypt:32768:8:1', not {method!r}")
+    return method
+
+# one hasher per app, set up from its config by create_app() - password_hasher stands for the one of the app handling the current request
+def init_app(app):
+    app.extensions['password_hasher'] = PasswordHasher(
+        check_method(app.config['PASSWORD_HASH_METHOD']),
+        app.config['PASSWORD_SALT_LENGTH'],
+        app.config['PASSWORD_HASH_WORKERS'],
+        app.config['PASSWORD_HASH_MAX_PENDING'],
+        app.config['PASSWORD_HASH_TIMEOUT']
+    )
+
+password_hasher = LocalProxy(lambda: current_app.extensions['password_hasher'])
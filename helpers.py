@@ -5,11 +5,22 @@
 # AND creates an encoder for our JSON content
 
 from functools import wraps
+import hashlib
 import secrets
-from flask import request, jsonify, json
+from flask import abort, request, jsonify, json, current_app
+from flask.json.provider import DefaultJSONProvider
+import datetime
 import decimal
+import uuid
 
-from models import User
+from cache import token_cache, MISSING
+from models import User, CONTACT_FIELDS, attach_snapshot
+
+# orjson is a much faster JSON library written in Rust - we use it when it's installed, and fall back to the standard json module when it isn't
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # check to see if 'x-access-token' is in our headers for our API calls
 # this process will help us modify the token in such a way that we can use the token and authenticate it
@@ -19,28 +30,122 @@ from models import User
 def token_required(our_flask_function):
     @wraps(our_flask_function)
     def decorated(*args, **kwargs):
-        token = None
-
-        if 'x-access-token' in request.headers:
-            token = request.headers['x-access-token'].split(' ')[1]
+        token = request_token()
         if not token:
             return jsonify({'message': 'Token is missing.'}), 401
 
-        try:
-            current_user_token = User.query.filter_by(token = token).first()
-            print(token)
-            print(current_user_token)
-        except:
-            owner=User.query.filter_by(token=token).first()
-
-            if token != owner.token and secrets.compare_digest(token, owner.token):
-                return jsonify({'message': 'Token is invalid'})
+        current_user_token = get_user_by_token(token)
+        if not token_matches(token, current_user_token):
+            return jsonify({'message': 'Token is invalid'}), 401
         return our_flask_function(current_user_token, *args, **kwargs)
     return decorated
 
-# this checks that the instance of json are decimals, and then changes them into strings that we can use later
-class JSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, decimal.Decimal):
-            return str(obj)
-        return super(JSONEncoder,self).default(obj)
\ No newline at end of file
+# operator_required guards the pages about the whole service (/metrics, /api/pool-stats) - a customer's api token doesn't open them
+# the caller sends 'Authorization: Bearer <OPERATOR_TOKEN>'; with no OPERATOR_TOKEN configured the pages don't exist at all (404)
+def operator_required(our_flask_function):
+    @wraps(our_flask_function)
+    def decorated(*args, **kwargs):
+        expected = current_app.config['OPERATOR_TOKEN']
+        if not expected:
+            abort(404)
+        scheme, space, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not secrets.compare_digest(token.strip().encode(), expected.encode()):
+            response = jsonify({'message': 'Operator token is missing or invalid.'})
+            return response, 401, {'WWW-Authenticate': 'Bearer'}
+        return our_flask_function(*args, **kwargs)
+    return decorated
+
+# the token is sent as 'x-access-token: Bearer <token>'
+# a header without the space (or with nothing after it) counts as no token, so the client gets 'Token is missing.' instead of a 500
+def request_token():
+    scheme, space, token = request.headers.get('x-access-token', '').partition(' ')
+    return token.split(' ')[0] or None
+
+# compare_digest takes the same time whether the first or the last character differs, so response times can't be used to guess a token
+def token_matches(token, user):
+    return user is not None and secrets.compare_digest(token, user.token)
+
+# this is the token lookup behind token_required
+# it is the query our api runs most, so we remember the answer in token_cache (see cache.py) - including None for tokens that don't exist
+# a cached user is a detached snapshot; attach_snapshot (models.py) gives this request a copy in its session without going back to the database
+def get_user_by_token(token):
+    user = token_cache.get(token)
+    if user is MISSING:
+        user = User.query.filter_by(token = token).first()
+        token_cache.set(token, user.snapshot() if user else None)
+        return user
+    if user is None:
+        return None
+    return attach_snapshot(user)
+
+# HTTP conditional requests: we send an ETag (a fingerprint of what we sent) with a response, the client sends it back in If-None-Match,
+# and if nothing changed we answer '304 Not Modified' with no body - the client keeps using its copy
+# make_etag hashes whatever identifies the response (user, version, query string...) into a strong ETag
+def make_etag(*parts):
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()[:24]
+
+# True when the client's copy is still good - If-None-Match wins over If-Modified-Since when both are sent
+def client_is_current(etag, last_modified = None):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified.replace(microsecond = 0) <= request.if_modified_since.replace(tzinfo = None)
+    return False
+
+# adds the validators to a response; a 304 is the same minus the body
+# responses depend on the x-access-token header, so shared caches must keep them apart per token
+def conditional(response, etag, last_modified = None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.vary.add('x-access-token')
+    return response
+
+def not_modified(etag, last_modified = None):
+    return conditional(current_app.response_class(status = 304), etag, last_modified)
+
+# FastJSONProvider is what app.json uses for jsonify() and every other JSON response
+# Decimals become strings, datetimes/dates become ISO 8601 strings and UUIDs become strings,
+# and the output is the same whether orjson is installed or not - orjson just gets there faster
+def json_default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default = json_default, option = orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, default = json_default, separators = (',', ':'), ensure_ascii = False)
+
+class FastJSONProvider(DefaultJSONProvider):
+    sort_keys = False
+    default = staticmethod(json_default)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default = json_default, option = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE),
+            mimetype = self.mimetype
+        )
+
+# Turns contact rows (tuples from selecting models.contact_columns) straight into dicts, skipping Marshmallow
+def serialize_contact(row):
+    return dict(zip(CONTACT_FIELDS, row))
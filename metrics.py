@@ -0,0 +1,262 @@
+# metrics.py measures where the time goes, and shows it at /metrics in the Prometheus text format
+# (Prometheus - or anything that speaks its format - reads that page every few seconds and keeps the history for graphs and alerts)
+# What we record:
+# - how long every request takes, per blueprint and endpoint (site, auth, api...)
+# - every SQL query: how many per request, and how long each one takes (through SQLAlchemy's cursor events)
+# - how long each template takes to render (through Flask's template signals)
+# - hit ratios of the caches in cache.py, read fresh on every scrape
+# Plus an opt-in profiler (PROFILE_SLOW_REQUESTS) that samples what slow requests were busy doing and logs it
+
+# A HISTOGRAM counts observations into buckets ('how many requests took under 5ms, under 10ms...'), which is what percentiles are worked out from
+# LABELS split one metric into several series, e.g. one per endpoint
+
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+
+from flask import current_app, g, has_app_context, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra = ''):
+    labels = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+class Counter():
+    type = 'counter'
+
+    def __init__(self, name, help, labels = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield f'{self.name}{format_labels(self.labels, label_values)} {value}'
+
+class Histogram():
+    type = 'histogram'
+
+    def __init__(self, name, help, labels = (), buckets = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {label_values: ([*counts], total, count) for label_values, (counts, total, count) in self._values.items()}
+        for label_values, (counts, total, count) in sorted(values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield self.name + '_bucket' + format_labels(self.labels, label_values, 'le="%s"' % bound) + f' {bucket_count}'
+            yield self.name + '_bucket' + format_labels(self.labels, label_values, 'le="+Inf"') + f' {count}'
+            yield f'{self.name}_sum{format_labels(self.labels, label_values)} {total}'
+            yield f'{self.name}_count{format_labels(self.labels, label_values)} {count}'
+
+# a gauge whose values are worked out when /metrics is read - function returns {label values tuple: value}
+class CallbackGauge():
+    type = 'gauge'
+
+    def __init__(self, name, help, labels, function):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.function = function
+
+    def samples(self):
+        for label_values, value in sorted(self.function().items()):
+            yield f'{self.name}{format_labels(self.labels, label_values)} {value}'
+
+class Registry():
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+request_duration = registry.register(Histogram(
+    'http_request_duration_seconds', 'Time spent handling a request.', ('blueprint', 'endpoint', 'method', 'status')))
+request_queries = registry.register(Histogram(
+    'http_request_sql_queries', 'SQL queries run while handling a request.', ('blueprint', 'endpoint'), QUERY_COUNT_BUCKETS))
+query_duration = registry.register(Histogram(
+    'sql_query_duration_seconds', 'Time spent running one SQL statement.', ('statement',)))
+template_duration = registry.register(Histogram(
+    'template_render_duration_seconds', 'Time spent rendering a template.', ('template',)))
+slow_requests = registry.register(Counter(
+    'http_slow_requests_total', 'Requests slower than SLOW_REQUEST_MS.', ('blueprint', 'endpoint')))
+
+# the caches of the app being scraped (cache.init_app keeps them in app.extensions), read fresh every time /metrics is asked for
+def app_caches():
+    return current_app.extensions.get('caches', {}) if has_app_context() else {}
+
+def cache_hit_ratios():
+    ratios = {}
+    for name, cache in app_caches().items():
+        lookups = cache.hits + cache.misses
+        ratios[(name,)] = cache.hits / lookups if lookups else 0.0
+    return ratios
+
+registry.register(CallbackGauge('cache_hit_ratio', 'Share of cache lookups that were hits.', ('cache',), cache_hit_ratios))
+registry.register(CallbackGauge('cache_hits', 'Cache lookups that were hits.', ('cache',), lambda: {(name,): cache.hits for name, cache in app_caches().items()}))
+registry.register(CallbackGauge('cache_misses', 'Cache lookups that were misses.', ('cache',), lambda: {(name,): cache.misses for name, cache in app_caches().items()}))
+registry.register(CallbackGauge('cache_entries', 'Entries held in the cache.', ('cache',), lambda: {(name,): len(cache) for name, cache in app_caches().items()}))
+
+# The slow request profiler: one background thread looks at what every request thread is doing every PROFILE_INTERVAL_MS
+# and counts the stacks it sees. When a request turns out to be slower than SLOW_REQUEST_MS, its most common stacks get logged
+# Sampling costs almost nothing per request (unlike cProfile, which slows down every function call), but it is still off unless you turn it on
+class SlowRequestProfiler():
+    def __init__(self, interval, depth = 12, top = 5):
+        self.interval = interval
+        self.depth = depth
+        self.top = top
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target = self.run, name = 'slow-request-profiler', daemon = True)
+                self._thread.start()
+            self._active[threading.get_ident()] = StackCounter()
+
+    def stop(self):
+        with self._lock:
+            return self._active.pop(threading.get_ident(), None)
+
+    def stack(self, frame):
+        entries = []
+        while frame is not None and len(entries) < self.depth:
+            entries.append(f'{frame.f_code.co_filename}:{frame.f_lineno} {frame.f_code.co_name}')
+            frame = frame.f_back
+        return tuple(entries)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[self.stack(frame)] += 1
+
+    def report(self, samples):
+        total = sum(samples.values())
+        lines = []
+        for stack, count in samples.most_common(self.top):
+            lines.append(f'  {count}/{total} samples:')
+            lines.extend(f'    {entry}' for entry in stack)
+        return '\n'.join(lines)
+
+def request_labels():
+    return (request.blueprint or '', request.endpoint or 'unmatched')
+
+def init_app(app):
+    slow_after = app.config['SLOW_REQUEST_MS'] / 1000
+    profiler = SlowRequestProfiler(app.config['PROFILE_INTERVAL_MS'] / 1000) if app.config['PROFILE_SLOW_REQUESTS'] else None
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_queries = 0
+        if profiler is not None:
+            profiler.start()
+
+    @app.after_request
+    def record_request(response):
+        finish_request(response.status_code)
+        return response
+
+    # after_request doesn't run when a view raises, so the error is recorded here instead
+    @app.teardown_request
+    def record_failed_request(error):
+        if error is not None:
+            finish_request(500)
+
+    def finish_request(status):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        blueprint, endpoint = request_labels()
+        request_duration.observe(duration, blueprint, endpoint, request.method, str(status))
+        request_queries.observe(g.pop('metrics_queries', 0), blueprint, endpoint)
+
+        samples = profiler.stop() if profiler is not None else None
+        if duration >= slow_after:
+            slow_requests.inc(blueprint, endpoint)
+            if samples:
+                app.logger.warning(
+                    'Slow request %s %s took %.0f ms, most sampled stacks:\n%s',
+                    request.method, request.path, duration * 1000, profiler.report(samples))
+
+    @before_render_template.connect_via(app)
+    def start_template_timer(sender, template, context, **extra):
+        if has_request_context():
+            g.setdefault('metrics_templates', []).append(time.perf_counter())
+
+    @template_rendered.connect_via(app)
+    def record_template(sender, template, context, **extra):
+        if has_request_context() and g.get('metrics_templates'):
+            template_duration.observe(time.perf_counter() - g.metrics_templates.pop(), template.name or 'string')
+
+# SQL timing, for every engine: the start time goes on the connection, and the request's query counter goes up
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(connection, cursor, statement, parameters, context, executemany):
+    started = connection.info['metrics_started'].pop()
+    query_duration.observe(time.perf_counter() - started, statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER')
+    if has_request_context() and 'metrics_queries' in g:
+        g.metrics_queries += 1
+
+# a statement that fails never reaches after_cursor_execute, so its start time is dropped here
+@event.listens_for(Engine, 'handle_error')
+def forget_failed_query(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('metrics_started'):
+        connection.info['metrics_started'].pop()
@@ -3,14 +3,19 @@
 # these are presets for creating our databases so we don't have to write SQL tables and queries, we'll automate that stuff instead
 
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 import uuid
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from flask_login import LoginManager
 from flask_marshmallow import Marshmallow
+from marshmallow import fields, validate
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session, configure_mappers, make_transient_to_detached, validates
+from sqlalchemy.orm.attributes import set_committed_value
 import secrets
+
+from cache import token_cache, user_cache, MISSING
+from hashing import password_hasher
 # SQLAlchemy and Migrate: will take care of writing SQL queries into Python, which allows us to focus more on what data we want to pass to our database rather than how to pass it
 
 # UUID stands for universally unique identifiers: great for creating independent items that won't clash with other items - in the same way that our SQL keys needed primary keys to stay unique, we need things like users to have unique ID numbers so that we don't accidentally delete users or have multiple users log in to the same account
@@ -27,9 +32,31 @@ db = SQLAlchemy()
 # Marshmallow is similar and also helps out with Migrations for moving data around
 # LoginManager is a class that helps with logging users in and keeping them logged in. When our browser 'talks' to the LoginManager class, it simply requests the user id from our User class - useful for checking if users are already logged in or not
 
+# Flask-Login calls load_user whenever a request touches current_user, and remembers the answer for the rest of that request (on flask's g object)
+# so within one request we already only load once - user_cache makes the NEXT requests skip the database as well
+# what we keep is a detached snapshot of the user, and attach_snapshot hands this request its own copy without running a query
 @login_manager.user_loader
 def load_user(user_id):
-  return User.query.get(user_id)
+  user = user_cache.get(user_id)
+  if user is MISSING:
+    user = User.query.get(user_id)
+    if user is not None:
+      user_cache.set(user_id, user.snapshot())
+    return user
+  return attach_snapshot(user)
+
+# merge(load=False) copies the snapshot's columns onto the session's instance - so when the session already holds this user
+# (loaded or changed earlier in the same session) that instance is newer than the snapshot, and we hand it out untouched instead
+def attach_snapshot(snapshot):
+  existing = db.session.identity_map.get(inspect(snapshot).key)
+  if existing is not None:
+    return existing
+  return db.session.merge(snapshot, load = False)
+
+# call this after changing a user row outside of the ORM (raw SQL, bulk updates), where the events below can't see it
+def invalidate_user(user):
+  user_cache.delete(user.id)
+  token_cache.delete(user.token)
 
 class User(db.Model, UserMixin):
     id = db.Column(db.String, primary_key=True)
@@ -40,6 +67,8 @@ class User(db.Model, UserMixin):
     g_auth_verify = db.Column(db.Boolean, default = False)
     token = db.Column(db.String, default = '', unique = True )
     date_created = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
+    # goes up by one for every contact this user adds, changes or deletes - see bump_phonebook_version below
+    phonebook_version = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
 
     def __init__(self, email, first_name='', last_name='', password='', token='', g_auth_verify=False):
         self.id = self.set_id()
@@ -57,12 +86,54 @@ class User(db.Model, UserMixin):
         return str(uuid.uuid4())
     
     def set_password(self, password):
-        self.pw_hash = generate_password_hash(password)
+        self.pw_hash = password_hasher.hash(password)
         return self.pw_hash
 
+    def snapshot(self):
+        return User.detached({column.key: getattr(self, column.key) for column in self.__table__.columns})
+
+    # the async tier can get here before any ORM query has set the mappers up, and set_committed_value needs them
+    @classmethod
+    def detached(cls, values):
+        configure_mappers()
+        copy = cls.__mapper__.class_manager.new_instance()
+        for key, value in values.items():
+            set_committed_value(copy, key, value)
+        make_transient_to_detached(copy)
+        return copy
+
     def __repr__(self):
         return f'User {self.email} has been added to the database'
 
+# When a user row changes or is deleted, the caches in cache.py must forget it
+# otherwise a worker would keep serving the old user (or accepting a rotated token) until the entry expired
+# For a token rotation (user.token = user.set_token(24)) we also drop the new token, in case somebody had tried it earlier and it was cached as 'invalid'
+# The flush only remembers what to forget (on session.info) - the caches are cleared once the transaction COMMITS
+# Clearing them at flush time would leave a gap before the commit where another request could miss the cache, read the old row and put it back
+def forgotten_users(session):
+    return session.info.setdefault('forget_users', [])
+
+@event.listens_for(User, 'after_update')
+def forget_updated_user(mapper, connection, target):
+    history = inspect(target).attrs.token.history
+    tokens = (history.deleted or ()) + (history.added or ())
+    forgotten_users(Session.object_session(target)).append((target.id, tokens))
+
+@event.listens_for(User, 'after_delete')
+def forget_deleted_user(mapper, connection, target):
+    forgotten_users(Session.object_session(target)).append((target.id, (target.token,)))
+
+@event.listens_for(Session, 'after_commit')
+def evict_forgotten_users(session):
+    for user_id, tokens in session.info.pop('forget_users', ()):
+        user_cache.delete(user_id)
+        for token in tokens:
+            token_cache.delete(token)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_forgotten_users(session, previous_transaction):
+    session.info.pop('forget_users', None)
+
 # The variables inside of our User class have a number of traits that sound very suspiciously similar to SQL data items.
 # These are all aspects of our SQL that SQLAlchemy translates for us.
 # The variables are all the headers of columns.
@@ -76,17 +147,37 @@ class User(db.Model, UserMixin):
 # We set the token, calling on the 'secrets' import to generate a token.
 # We pass in the 24 character length as an integer during the __init__ method
 # The set_id method creates a unique id number that we'll use as a primary key, since it's unique. You don't want to use the name as primary key, in case multiple users have the same name.
-# set_password generates a hash that makes it impossible for the database owner to see the actual password
+# set_password generates a hash that makes it impossible for the database owner to see the actual password (the hashing itself happens in hashing.py)
+# snapshot makes a detached copy of the user with all its columns already loaded - it doesn't belong to any database session, so it is safe to keep in a cache between requests
+# detached builds the same kind of copy from plain column values, e.g. a row fetched without the ORM
 # __repr__ method prints out at the end - this will show up in our terminal eventually
 
+# '+1 (555) 013-4567', '555.013.4567' and '15550134567' all come out as plain digits, so they can be compared with each other
+def normalize_phone(phone_number):
+    return ''.join(character for character in phone_number or '' if character.isdigit())
+
 #NEXT Create the Contact class (data item that we're going to save in our database, which we'll allow users to look at later):
 class Contact(db.Model):
+    # the composite index on (user_token, id) lets us walk one user's phonebook in id order as an index range scan
+    # without it, every listing has to read the whole user_token partition (there isn't even an index on the foreign key)
+    # (user_token, name, email, phone_digits) holds everything search.py matches on, so a search reads one user's index entries and nothing else
+    __table_args__ = (
+        db.Index('ix_contact_user_token_id', 'user_token', 'id'),
+        db.Index('ix_contact_user_token_version', 'user_token', 'version'),
+        db.Index('ix_contact_user_token_search', 'user_token', 'name', 'email', 'phone_digits'),
+    )
+
     id = db.Column(db.String, primary_key = True)
     name = db.Column(db.String(150), nullable = False)
     email = db.Column(db.String(200))
     phone_number = db.Column(db.String(20))
+    # the phone number with everything but the digits stripped out - this is what search.py indexes and matches phone queries against
+    phone_digits = db.Column(db.String(20))
     address = db.Column(db.String(200))
     user_token = db.Column(db.String, db.ForeignKey('user.token'), nullable = False)
+    # the user's phonebook_version when this contact last changed, and when that was
+    version = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
+    updated_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
 
     def __init__(self,name,email,phone_number,address,user_token, id = ''):
         self.id = self.set_id()
@@ -97,16 +188,81 @@ class Contact(db.Model):
         self.user_token = user_token
 
 
+    # runs every time phone_number is assigned (including in __init__), so phone_digits can't fall out of step with it
+    @validates('phone_number')
+    def set_phone_digits(self, key, phone_number):
+        self.phone_digits = normalize_phone(phone_number)
+        return phone_number
+
     def __repr__(self):
         return f'The following contact has been added to the phonebook: {self.name}'
 
-    def set_id(self):
+    # a staticmethod so code that inserts contacts without building Contact objects (like the bulk import) can make ids the same way
+    @staticmethod
+    def set_id():
         return (secrets.token_urlsafe())
 
+# A tombstone is left behind when a contact is deleted, so a phone that synced earlier can be told to delete its copy too
+class ContactTombstone(db.Model):
+    __table_args__ = (
+        db.Index('ix_contact_tombstone_user_token_version', 'user_token', 'version'),
+    )
+
+    id = db.Column(db.String, primary_key = True)
+    user_token = db.Column(db.String, db.ForeignKey('user.token'), nullable = False)
+    version = db.Column(db.Integer, nullable = False)
+    deleted_at = db.Column(db.DateTime, nullable = False, default = datetime.utcnow)
+
+# Phonebook versions: every change to a user's contacts takes the next number(s) from user.phonebook_version
+# and stamps it on the contact (or its tombstone), so 'what changed since version N' is one indexed query
+# and the version doubles as an ETag for the whole phonebook (see app/api/routes.py)
+# The UPDATE locks the user's row until the transaction ends, so two writers can't hand out the same number
+# count lets the bulk import reserve a block of numbers at once - it returns the LAST one of the block
+def bump_phonebook_version(connection, user_token, count = 1):
+    user_table = User.__table__
+    connection.execute(
+        user_table.update()
+        .where(user_table.c.token == user_token)
+        .values(phonebook_version = user_table.c.phonebook_version + count)
+    )
+    return connection.execute(select(user_table.c.phonebook_version).where(user_table.c.token == user_token)).scalar()
+
+@event.listens_for(Contact, 'before_insert')
+def version_new_contact(mapper, connection, target):
+    target.version = bump_phonebook_version(connection, target.user_token)
+    target.updated_at = datetime.utcnow()
+
+@event.listens_for(Contact, 'before_update')
+def version_changed_contact(mapper, connection, target):
+    if not Session.object_session(target).is_modified(target, include_collections = False):
+        return
+    target.version = bump_phonebook_version(connection, target.user_token)
+    target.updated_at = datetime.utcnow()
+
+@event.listens_for(Contact, 'after_delete')
+def leave_tombstone(mapper, connection, target):
+    connection.execute(ContactTombstone.__table__.insert().values(
+        id = target.id,
+        user_token = target.user_token,
+        version = bump_phonebook_version(connection, target.user_token),
+        deleted_at = datetime.utcnow()
+    ))
+
 # NEXT call on Marshmallow finally- this basically is another function that is part of the process of uploading our data to our database. NOTE THAT THE FIELDS MUST MATCH OUR CONTACT CLASS HERE. If they don't, there will be errors:
+# The declared fields are what we validate incoming contacts against when loading (e.g. the bulk import) - the lengths match the Contact columns
 class ContactSchema(ma.Schema):
+    id = fields.String(dump_only = True)
+    name = fields.String(required = True, validate = validate.Length(min = 1, max = 150))
+    email = fields.Email(allow_none = True, validate = validate.Length(max = 200))
+    phone_number = fields.String(allow_none = True, validate = validate.Length(max = 20))
+    address = fields.String(allow_none = True, validate = validate.Length(max = 200))
+
     class Meta:
         fields = ['id', 'name','email','phone_number', 'address']
 
 contact_schema = ContactSchema()
-contacts_schema = ContactSchema(many=True)
\ No newline at end of file
+contacts_schema = ContactSchema(many=True)
+
+# The same fields as plain columns, for code that selects contact rows as tuples instead of building Contact objects (listing, export, search)
+CONTACT_FIELDS = tuple(ContactSchema.Meta.fields)
+contact_columns = [getattr(Contact, field) for field in CONTACT_FIELDS]
\ No newline at end of file
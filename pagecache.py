@@ -0,0 +1,91 @@
+# pagecache.py keeps the site blueprint from re-rendering the same HTML over and over
+# - cache_page: a whole page is rendered once and kept in cache.page_cache; anonymous visitors get the stored copy,
+#   and a Cache-Control header lets their browser (and any proxy) reuse it for PAGE_CACHE_MAX_AGE seconds without asking again
+# - cached_fragment: a piece of a page that belongs to one user (e.g. their profile details), kept per user and per VERSION
+#   of what it shows - when the data changes the version changes, so the old copy is simply never asked for again
+# - init_app: compiles every template at startup and fingerprints static files so they can be cached for a year
+
+import hashlib
+import os
+from functools import wraps
+
+import click
+from flask import current_app, request
+from flask_login import current_user
+from markupsafe import Markup
+
+from cache import page_cache, MISSING
+
+# Each route picks its policy: max_age is how long browsers may keep the page
+# Logged in users always get a freshly rendered page marked 'private', since the navigation and content may be theirs alone
+def cache_page(max_age = None):
+    def decorator(view):
+        @wraps(view)
+        def decorated(*args, **kwargs):
+            if current_user.is_authenticated:
+                response = current_app.make_response(view(*args, **kwargs))
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+                return response
+
+            key = ('page', request.path, request.query_string)
+            body = page_cache.get(key)
+            if body is MISSING:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data(as_text = True)
+                page_cache.set(key, body)
+
+            response = current_app.make_response(body)
+            response.cache_control.public = True
+            response.cache_control.max_age = current_app.config['PAGE_CACHE_MAX_AGE'] if max_age is None else max_age
+            return response
+        return decorated
+    return decorator
+
+# render() is only called when this user's fragment isn't cached yet for this version
+def cached_fragment(name, user_id, version, render):
+    key = ('fragment', name, user_id, version)
+    html = page_cache.get(key)
+    if html is MISSING:
+        html = render()
+        page_cache.set(key, html)
+    return Markup(html)
+
+# Static file fingerprints: the hash of the file's contents goes into its url as ?v=..., so a changed file gets a new url
+# That makes it safe to tell browsers to keep a fingerprinted file for a year - they'll fetch the new url when it changes
+def init_app(app):
+    fingerprints = {}
+
+    def fingerprint(filename):
+        if filename not in fingerprints:
+            path = os.path.join(app.static_folder, filename)
+            try:
+                with open(path, 'rb') as file:
+                    fingerprints[filename] = hashlib.sha1(file.read()).hexdigest()[:12]
+            except OSError:
+                fingerprints[filename] = None
+        return fingerprints[filename]
+
+    @app.url_defaults
+    def add_static_fingerprint(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            version = fingerprint(values['filename'])
+            if version:
+                values['v'] = version
+
+    @app.after_request
+    def cache_fingerprinted_static(response):
+        if request.endpoint == 'static' and request.args.get('v') and response.status_code == 200:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = app.config['STATIC_FINGERPRINT_MAX_AGE']
+            response.cache_control.immutable = True
+        return response
+
+    # Jinja turns each template into Python code the first time it is used - doing it now moves that cost off the first requests
+    # The flask command builds the app inside a click context; a CLI process doesn't serve requests, so it doesn't pay for this
+    if app.config['PRECOMPILE_TEMPLATES'] and click.get_current_context(silent = True) is None:
+        for name in app.jinja_env.list_templates(extensions = ['html']):
+            app.jinja_env.get_template(name)
@@ -0,0 +1,249 @@
+# search.py powers the type-ahead contact search at /api/contacts/search
+# Every search belongs to ONE user, so the first thing to narrow down is the user, not the text:
+# - a normal sized phonebook is searched with LIKE '%text%' on the covering index (user_token, name, email, phone_digits) -
+#   only that user's index entries are read, already in name order, and the table itself is only touched for the rows we return
+# - SQLite, for phonebooks too big to scan (more than SCAN_ROWS): an FTS5 full text table using the 'trigram' tokenizer,
+#   so any 3+ character piece of a name/email/phone matches
+# - Postgres: the pg_trgm extension with a GIN index, which lets ILIKE '%text%' use an index - the planner picks it or the per-user index
+# - anything else: an in-memory prefix trie per user, built the first time that user searches
+# The FTS table and the GIN index hold every user's contacts, so on their own they find (and would rank) matches from every phonebook -
+# for a normal phonebook that is hundreds of times more work than reading the one user's index entries
+# Phone numbers are matched on their digits only (see normalize_phone in models.py), so '555-0134', '(555) 0134' and '+15550134' all find the same contact
+
+import re
+import threading
+
+from flask import current_app
+from sqlalchemy import or_, text
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+
+from werkzeug.local import LocalProxy
+
+from cache import TTLCache, MISSING
+from models import db, Contact, contact_columns, normalize_phone
+
+# the trigram indexes can only help once the query has at least 3 characters
+MIN_TRIGRAM_LENGTH = 3
+
+# national numbers are at most 10 digits in most plans - a longer query probably starts with a country code
+NATIONAL_NUMBER_LENGTH = 10
+
+# up to this many contacts the per-user scan stays within a few milliseconds even when nothing matches (about 0.4 microseconds per contact)
+# phonebook_version is never smaller than the number of contacts (every insert takes a version), so it tells us which side of this we're on
+SCAN_ROWS = 20000
+
+# SQLite: the FTS5 table stores no copy of the data (content='contact'), it only indexes it.
+# The triggers keep it in step with every INSERT/UPDATE/DELETE on contact - including the bulk import, which skips the ORM
+sqlite_search_ddl = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS contact_search USING fts5(
+        name, email, phone_digits, content='contact', content_rowid='rowid', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS contact_search_insert AFTER INSERT ON contact BEGIN
+        INSERT INTO contact_search(rowid, name, email, phone_digits) VALUES (new.rowid, new.name, new.email, new.phone_digits);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS contact_search_delete AFTER DELETE ON contact BEGIN
+        INSERT INTO contact_search(contact_search, rowid, name, email, phone_digits) VALUES ('delete', old.rowid, old.name, old.email, old.phone_digits);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS contact_search_update AFTER UPDATE ON contact BEGIN
+        INSERT INTO contact_search(contact_search, rowid, name, email, phone_digits) VALUES ('delete', old.rowid, old.name, old.email, old.phone_digits);
+        INSERT INTO contact_search(rowid, name, email, phone_digits) VALUES (new.rowid, new.name, new.email, new.phone_digits);
+    END""",
+]
+
+# Postgres: a normal index on the contact table, so the database keeps it in sync by itself
+postgres_search_ddl = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS ix_contact_search_trgm ON contact '
+    'USING gin (name gin_trgm_ops, email gin_trgm_ops, phone_digits gin_trgm_ops)',
+]
+
+# Neither of these is a model, so db.create_all() doesn't make them and `flask db migrate` doesn't write a migration for them
+# Instead ensure_search_index() creates whatever is missing (every statement is IF NOT EXISTS), and fills a NEW FTS table with the contacts already there
+# It runs once per engine, the first time a search needs the index - by then `flask db upgrade` has made the contact table -
+# or ahead of time with `flask api create-search-index` (a good idea on a big Postgres table, where building the index takes a while)
+# If it can't be created (no permission for CREATE EXTENSION, an SQLite without the trigram tokenizer) we log it and search without it
+# The answer is kept per engine in app.extensions['search_index_ready'], so another app (or a test) with its own database checks for itself
+search_index_lock = threading.Lock()
+
+def create_search_index(connection):
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'contact_search'")).first()
+        for statement in sqlite_search_ddl:
+            connection.execute(text(statement))
+        if not exists:
+            connection.execute(text("INSERT INTO contact_search(contact_search) VALUES ('rebuild')"))
+    elif dialect == 'postgresql':
+        for statement in postgres_search_ddl:
+            connection.execute(text(statement))
+
+def ensure_search_index():
+    engine = db.engine
+    search_index_ready = current_app.extensions.setdefault('search_index_ready', {})
+    ready = search_index_ready.get(engine)
+    if ready is not None:
+        return ready
+    with search_index_lock:
+        if engine not in search_index_ready:
+            try:
+                create_search_index(db.session.connection())
+                db.session.commit()
+                search_index_ready[engine] = True
+            except SQLAlchemyError as error:
+                db.session.rollback()
+                current_app.logger.warning('Could not create the contact search index, searching without it: %s', error)
+                search_index_ready[engine] = False
+    return search_index_ready[engine]
+
+# the index went missing after we saw it (the database was dropped and made again, or restored from a backup) - the next search checks again
+def forget_search_index():
+    current_app.extensions.get('search_index_ready', {}).pop(db.engine, None)
+
+# the digit strings we look for: all of them, plus the national part when the query looks like it carries a country code
+def phone_queries(query):
+    digits = normalize_phone(query)
+    if not digits:
+        return []
+    queries = [digits]
+    if len(digits) > NATIONAL_NUMBER_LENGTH:
+        queries.append(digits[-NATIONAL_NUMBER_LENGTH:])
+    return queries
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# the name/email/phone conditions, as a prefix match ('text%') or anywhere in the value ('%text%')
+# SQLite's LIKE already ignores case (for ASCII), and ILIKE would wrap every column in lower() - twice as slow when nothing matches
+def match_conditions(query, anywhere):
+    def pattern(value):
+        return ('%' if anywhere else '') + escape_like(value) + '%'
+    compare = 'like' if db.engine.dialect.name == 'sqlite' else 'ilike'
+    conditions = [getattr(Contact.name, compare)(pattern(query), escape = '\\'), getattr(Contact.email, compare)(pattern(query), escape = '\\')]
+    conditions += [Contact.phone_digits.like(pattern(digits), escape = '\\') for digits in phone_queries(query)]
+    return conditions
+
+# one user's contacts, read from the (user_token, name, email, phone_digits) index in name order until 'limit' of them match
+def search_scan(user_token, query, limit, anywhere = True):
+    return db.session.query(*contact_columns) \
+        .filter(Contact.user_token == user_token, or_(*match_conditions(query, anywhere))) \
+        .order_by(Contact.name) \
+        .limit(limit).all()
+
+def fts_phrase(value):
+    return '"' + value.replace('"', '""') + '"'
+
+# Only for phonebooks bigger than SCAN_ROWS. CROSS JOIN makes SQLite walk the FTS matches and check the owner of each one,
+# instead of walking the user's contacts and probing the FTS table for every one of them.
+# There's no ORDER BY rank: ranking needs EVERY match from every user before the first row comes back - without it we stop at 'limit'
+def search_sqlite(user_token, query, limit, version):
+    if version <= SCAN_ROWS:
+        return search_scan(user_token, query, limit, anywhere = len(query) >= MIN_TRIGRAM_LENGTH)
+    if not ensure_search_index():
+        return search_scan(user_token, query, limit, anywhere = len(query) >= MIN_TRIGRAM_LENGTH)
+    terms = []
+    if len(query) >= MIN_TRIGRAM_LENGTH:
+        terms.append('{name email} : ' + fts_phrase(query))
+    terms += ['phone_digits : ' + fts_phrase(digits) for digits in phone_queries(query) if len(digits) >= MIN_TRIGRAM_LENGTH]
+    if not terms:
+        return search_scan(user_token, query, limit, anywhere = False)
+    try:
+        rows = db.session.execute(text(
+            'SELECT contact.id, contact.name, contact.email, contact.phone_number, contact.address '
+            'FROM contact_search CROSS JOIN contact ON contact.rowid = contact_search.rowid '
+            'WHERE contact_search MATCH :match AND contact.user_token = :user_token '
+            'LIMIT :limit'
+        ), {'match': ' OR '.join(terms), 'user_token': user_token, 'limit': limit}).all()
+    except OperationalError as error:
+        db.session.rollback()
+        forget_search_index()
+        current_app.logger.warning('The contact search index could not be used, searching without it: %s', error)
+        return search_scan(user_token, query, limit, anywhere = len(query) >= MIN_TRIGRAM_LENGTH)
+    return sorted(rows, key = lambda row: row.name)
+
+def search_postgres(user_token, query, limit):
+    ensure_search_index()
+    return search_scan(user_token, query, limit, anywhere = len(query) >= MIN_TRIGRAM_LENGTH)
+
+# The fallback: one character trie per user, mapping every searchable word to the contacts that contain it
+# Each node is a dict of next character -> node, and the '' key holds the ids of contacts whose word ends there
+# To match phone numbers anywhere (not just at the start) we also index every suffix of the phone digits
+# A trie is built from the database and remembers the phonebook_version it was built at - when the version has moved on
+# (a change made by ANY worker, or by a write that skipped the ORM) it is simply built again, so it can't go stale
+# The tries are kept in a TTLCache: at most SEARCH_TRIE_USERS of them per worker, each for at most SEARCH_TRIE_TTL seconds
+class PrefixIndex():
+    def __init__(self, maxsize, ttl):
+        self._users = TTLCache(maxsize, ttl)
+
+    def words(self, row):
+        id, name, email, phone_number, address = row
+        words = set()
+        if name:
+            name = name.lower()
+            words.add(name)
+            words.update(re.split(r'\W+', name))
+        if email:
+            email = email.lower()
+            words.add(email)
+            words.update(re.split(r'[@.+_-]+', email))
+        digits = normalize_phone(phone_number)
+        words.update(digits[start:] for start in range(len(digits)))
+        words.discard('')
+        return words
+
+    def add(self, user, row):
+        user['rows'][row[0]] = row
+        for word in self.words(row):
+            node = user['trie']
+            for character in word:
+                node = node.setdefault(character, {})
+            node.setdefault('', set()).add(row[0])
+
+    # the version is read before the contacts, so a change in between only makes the trie newer than its label - and rebuilt once more
+    def load(self, user_token, version):
+        user = {'version': version, 'trie': {}, 'rows': {}}
+        for row in db.session.query(*contact_columns).filter(Contact.user_token == user_token):
+            self.add(user, tuple(row))
+        return user
+
+    # a built trie is never changed again, so searches can read it without a lock
+    def search(self, user_token, query, limit, version):
+        user = self._users.get(user_token)
+        if user is MISSING or user['version'] != version:
+            user = self.load(user_token, version)
+            self._users.set(user_token, user)
+
+        found = []
+        for prefix in [query.lower()] + phone_queries(query):
+            node = user['trie']
+            for character in prefix:
+                node = node.get(character)
+                if node is None:
+                    break
+            else:
+                stack = [node]
+                while stack and len(found) < limit:
+                    node = stack.pop()
+                    for key, value in node.items():
+                        if key == '':
+                            found.extend(id for id in value if id not in found)
+                        else:
+                            stack.append(value)
+        return [user['rows'][id] for id in found[:limit]]
+
+# one per app, sized from its config - create_app() calls init_app when the api blueprint is registered
+def init_app(app):
+    app.extensions['search_trie'] = PrefixIndex(app.config['SEARCH_TRIE_USERS'], app.config['SEARCH_TRIE_TTL'])
+
+prefix_index = LocalProxy(lambda: current_app.extensions['search_trie'])
+
+# version is the user's current phonebook_version (read fresh by the route, the cached user may be older)
+def search_contacts(user_token, query, limit, version):
+    query = query.strip()
+    if not query:
+        return []
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return search_sqlite(user_token, query, limit, version)
+    if dialect == 'postgresql':
+        return search_postgres(user_token, query, limit)
+    return prefix_index.search(user_token, query, limit, version)
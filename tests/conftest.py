@@ -0,0 +1,43 @@
+# Shared fixtures: a fresh app on an in-memory SQLite database for every test, and a user with an api token
+# Hashing runs inline with a cheap cost so the tests don't wait on pbkdf2
+
+import pytest
+
+from app import create_app
+from config import Config
+from models import db, User
+
+class TestConfig(Config):
+    TESTING = True
+    SECRET_KEY = 'test'
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    WTF_CSRF_ENABLED = False
+    MIGRATE_ENABLED = False
+    BLUEPRINTS = ['site', 'auth', 'api']
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    PASSWORD_HASH_WORKERS = 0
+    PAGE_CACHE_BACKEND = 'memory'
+
+@pytest.fixture
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def user(app):
+    user = User('ada@example.com', password = 'password')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+@pytest.fixture
+def headers(user):
+    return {'x-access-token': f'Bearer {user.token}'}
@@ -0,0 +1,102 @@
+from models import db, Contact, User
+
+def add_contacts(user, names):
+    contacts = [Contact(name, f'{name.lower()}@example.com', '555-0100', '1 Main Street', user.token) for name in names]
+    db.session.add_all(contacts)
+    db.session.commit()
+    return contacts
+
+def test_missing_and_malformed_tokens_are_401(client, user):
+    assert client.get('/api/contacts').status_code == 401
+    assert client.get('/api/contacts', headers = {'x-access-token': 'abc'}).status_code == 401
+    assert client.get('/api/contacts', headers = {'x-access-token': 'Bearer '}).status_code == 401
+    assert client.get('/api/contacts', headers = {'x-access-token': 'Bearer wrong'}).status_code == 401
+
+def test_contacts_etag_answers_304_until_the_phonebook_changes(client, user, headers):
+    add_contacts(user, ['Ada'])
+    response = client.get('/api/contacts', headers = headers)
+    etag = response.headers['ETag']
+    assert response.status_code == 200
+
+    response = client.get('/api/contacts', headers = {**headers, 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    add_contacts(user, ['Grace'])
+    response = client.get('/api/contacts', headers = {**headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_contact_etag_follows_its_version(client, user, headers):
+    contact, = add_contacts(user, ['Ada'])
+    response = client.get(f'/api/contacts/{contact.id}', headers = headers)
+    etag = response.headers['ETag']
+    assert client.get(f'/api/contacts/{contact.id}', headers = {**headers, 'If-None-Match': etag}).status_code == 304
+
+    contact.name = 'Ada Lovelace'
+    db.session.commit()
+    response = client.get(f'/api/contacts/{contact.id}', headers = {**headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['name'] == 'Ada Lovelace'
+
+def test_changes_merges_updates_and_tombstones_in_version_order(client, user, headers):
+    ada, grace, alan = add_contacts(user, ['Ada', 'Grace', 'Alan'])
+    db.session.delete(grace)
+    db.session.commit()
+    ada.name = 'Ada Lovelace'
+    db.session.commit()
+
+    response = client.get('/api/contacts/changes?since=0', headers = headers).get_json()
+    # grace was created at 2 and deleted at 4, ada created at 1 and changed at 5 - only the latest of each is sent
+    assert [contact['name'] for contact in response['contacts']] == ['Alan', 'Ada Lovelace']
+    assert response['deleted'] == [grace.id]
+    assert response['version'] == 5
+    assert response['has_more'] is False
+
+    response = client.get('/api/contacts/changes?since=3', headers = headers).get_json()
+    assert [contact['id'] for contact in response['contacts']] == [ada.id]
+    assert response['deleted'] == [grace.id]
+
+    response = client.get('/api/contacts/changes?since=5', headers = headers).get_json()
+    assert response == {'version': 5, 'contacts': [], 'deleted': [], 'has_more': False}
+
+def test_changes_pages_with_has_more_and_resumes_from_version(client, user, headers):
+    contacts = add_contacts(user, ['Ada', 'Grace', 'Alan', 'Linus'])
+    db.session.delete(contacts[1])
+    db.session.commit()
+
+    # versions: Ada 1, Grace 2, Alan 3, Linus 4, Grace's tombstone 5
+    seen, deleted, versions = [], [], []
+    while True:
+        since = versions[-1] if versions else 0
+        response = client.get(f'/api/contacts/changes?since={since}&limit=2', headers = headers).get_json()
+        seen += [contact['name'] for contact in response['contacts']]
+        deleted += response['deleted']
+        versions.append(response['version'])
+        if not response['has_more']:
+            break
+
+    # the first page stops at the last change it sent, the second ends at the phonebook's version
+    assert versions == [3, 5]
+    assert db.session.get(User, user.id).phonebook_version == 5
+    assert seen == ['Ada', 'Alan', 'Linus']
+    assert deleted == [contacts[1].id]
+
+def test_changes_etag_answers_304(client, user, headers):
+    add_contacts(user, ['Ada'])
+    response = client.get('/api/contacts/changes?since=0', headers = headers)
+    etag = response.headers['ETag']
+    assert client.get('/api/contacts/changes?since=0', headers = {**headers, 'If-None-Match': etag}).status_code == 304
+
+    add_contacts(user, ['Grace'])
+    assert client.get('/api/contacts/changes?since=0', headers = {**headers, 'If-None-Match': etag}).status_code == 200
+
+def test_changes_are_per_user(client, user, headers):
+    other = User('grace@example.com', password = 'password')
+    db.session.add(other)
+    db.session.commit()
+    add_contacts(other, ['Grace'])
+    add_contacts(user, ['Ada'])
+
+    response = client.get('/api/contacts/changes?since=0', headers = headers).get_json()
+    assert [contact['name'] for contact in response['contacts']] == ['Ada']
@@ -0,0 +1,100 @@
+import json
+
+from app.api.routes import MAX_REPORTED_ERRORS
+from models import db, Contact, User
+
+def bulk_import(client, headers, body, content_type, query = ''):
+    response = client.post(f'/api/contacts/bulk{query}', data = body, headers = {**headers, 'Content-Type': content_type})
+    assert response.status_code == 200
+    return response.get_json()
+
+def saved_names(user):
+    return sorted(name for name, in db.session.query(Contact.name).filter(Contact.user_token == user.token))
+
+def test_csv_rows_are_imported_and_bad_rows_reported(client, user, headers):
+    body = (
+        'name,email,phone_number,address\n'
+        'Ada,ada@example.com,+1 (555) 010-0001,1 Main Street\n'
+        ',nobody@example.com,,\n'
+        'Grace,not-an-email,,\n'
+        'Alan,,,\n'
+    )
+    result = bulk_import(client, headers, body, 'text/csv')
+
+    assert result['inserted'] == 2
+    assert result['failed'] == 2
+    assert [error['row'] for error in result['errors']] == [2, 3]
+    assert 'name' in result['errors'][0]['errors']
+    assert 'email' in result['errors'][1]['errors']
+    assert result['errors_truncated'] is False
+    assert saved_names(user) == ['Ada', 'Alan']
+    assert db.session.query(Contact.phone_digits).filter(Contact.name == 'Ada').scalar() == '15550100001'
+
+def test_jsonl_rows_are_imported_and_bad_rows_reported(client, user, headers):
+    lines = [
+        json.dumps({'name': 'Ada', 'email': 'ada@example.com'}),
+        '{not json',
+        '',
+        json.dumps(['Grace']),
+        json.dumps({'email': 'alan@example.com'}),
+        json.dumps({'name': 'Linus', 'unknown': 'ignored'})
+    ]
+    result = bulk_import(client, headers, '\n'.join(lines) + '\n', 'application/x-ndjson')
+
+    assert result['inserted'] == 2
+    assert result['failed'] == 3
+    # blank lines are skipped without taking a row number
+    assert [error['row'] for error in result['errors']] == [2, 3, 4]
+    assert result['errors'][0]['errors']['_row'][0].startswith('Invalid JSON')
+    assert result['errors'][1]['errors'] == {'_row': ['Each line must be a JSON object.']}
+    assert 'name' in result['errors'][2]['errors']
+    assert saved_names(user) == ['Ada', 'Linus']
+
+def test_batches_take_consecutive_versions(client, user, headers):
+    body = 'name\n' + ''.join(f'Contact {number}\n' for number in range(5))
+    result = bulk_import(client, headers, body, 'text/csv', '?batch_size=2')
+
+    assert result == {'inserted': 5, 'failed': 0, 'errors': [], 'errors_truncated': False}
+    versions = sorted(version for version, in db.session.query(Contact.version).filter(Contact.user_token == user.token))
+    assert versions == [1, 2, 3, 4, 5]
+    assert db.session.get(User, user.id).phonebook_version == 5
+
+# a batch whose INSERT fails is reported as a whole, and the batches before it stay saved
+def test_failed_batch_is_reported_and_earlier_batches_kept(client, user, headers, monkeypatch):
+    ids = iter(['first', 'second', 'first', 'third'])
+    monkeypatch.setattr(Contact, 'set_id', staticmethod(lambda: next(ids)))
+    body = 'name\nAda\nGrace\nAlan\nLinus\n'
+    result = bulk_import(client, headers, body, 'text/csv', '?batch_size=2')
+
+    assert result['inserted'] == 2
+    assert result['failed'] == 2
+    assert result['errors'][0]['row'] == 3
+    assert result['errors'][0]['errors']['_batch'][0].startswith('Rows 3-4 were not saved')
+    assert saved_names(user) == ['Ada', 'Grace']
+
+def test_reported_errors_are_capped(client, user, headers):
+    body = '[]\n' * (MAX_REPORTED_ERRORS + 5)
+    result = bulk_import(client, headers, body, 'application/x-ndjson')
+
+    assert result['failed'] == MAX_REPORTED_ERRORS + 5
+    assert len(result['errors']) == MAX_REPORTED_ERRORS
+    assert result['errors_truncated'] is True
+
+def test_invalid_utf8_is_a_row_error(client, user, headers):
+    body = 'name,email\nAda,ada@example.com\n'.encode() + b'Gr\xffce,grace@example.com\n' + 'Alan,alan@example.com\n'.encode()
+    result = bulk_import(client, headers, body, 'text/csv', '?batch_size=1')
+
+    assert result['inserted'] == 2
+    assert result['failed'] == 1
+    assert result['errors'] == [{'row': 2, 'errors': {'_row': ['Not valid UTF-8 text.']}}]
+    assert saved_names(user) == ['Ada', 'Alan']
+
+def test_utf8_bom_is_ignored(client, user, headers):
+    result = bulk_import(client, headers, '﻿name\nAda\n'.encode(), 'text/csv')
+    assert result['inserted'] == 1
+    assert saved_names(user) == ['Ada']
+
+def test_unknown_content_type_is_415(client, user, headers):
+    response = client.post('/api/contacts/bulk', data = 'name\nAda\n', headers = {**headers, 'Content-Type': 'text/plain'})
+    assert response.status_code == 415
+    assert saved_names(user) == []
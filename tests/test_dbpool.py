@@ -0,0 +1,43 @@
+from sqlalchemy import text
+
+from app import create_app
+from dbpool import TimedQueuePool
+from models import db
+from conftest import TestConfig
+
+def file_app(path):
+    class FileConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        OPERATOR_TOKEN = 'operator-secret'
+    return create_app(FileConfig)
+
+def pool_stats(app, headers):
+    response = app.test_client().get('/api/pool-stats', headers = headers)
+    assert response.status_code == 200
+    return response.get_json()
+
+# each engine's pool counts only its own checkouts
+def test_every_pool_keeps_its_own_stats(tmp_path):
+    busy, idle = file_app(tmp_path / 'busy.db'), file_app(tmp_path / 'idle.db')
+    with busy.app_context():
+        assert isinstance(db.engine.pool, TimedQueuePool)
+        for number in range(3):
+            db.session.execute(text('SELECT 1'))
+            db.session.remove()
+
+    operator = {'Authorization': 'Bearer operator-secret'}
+    busy_checkouts = pool_stats(busy, operator)['checkout_wait']['checkouts']
+    idle_checkouts = pool_stats(idle, operator)['checkout_wait']['checkouts']
+    assert busy_checkouts >= 3
+    assert idle_checkouts < busy_checkouts
+
+def test_pool_stats_need_the_operator_token(tmp_path, headers):
+    app = file_app(tmp_path / 'phonebook.db')
+    client = app.test_client()
+    # a customer's api token doesn't open it, in either header
+    assert client.get('/api/pool-stats', headers = headers).status_code == 401
+    assert client.get('/api/pool-stats', headers = {'Authorization': headers['x-access-token']}).status_code == 401
+    assert pool_stats(app, {'Authorization': 'Bearer operator-secret'})['pool'] == 'TimedQueuePool'
+
+def test_pool_stats_are_hidden_without_an_operator_token(client, headers):
+    assert client.get('/api/pool-stats', headers = headers).status_code == 404
@@ -0,0 +1,59 @@
+import csv
+import io
+import json
+
+from models import db, Contact, User
+
+def export(client, headers, format):
+    response = client.get(f'/api/contacts/export?format={format}', headers = headers)
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'] == f'attachment; filename=contacts.{format}'
+    return response
+
+def test_empty_csv_export_still_has_the_header(client, user, headers):
+    response = export(client, headers, 'csv')
+    assert response.mimetype == 'text/csv'
+    assert response.get_data(as_text = True) == 'id,name,email,phone_number,address\r\n'
+
+def test_csv_export(client, user, headers):
+    db.session.add(Contact('Lovelace, Ada', 'ada@example.com', '555-0100', '1 "Main" Street', user.token))
+    db.session.commit()
+    rows = list(csv.DictReader(io.StringIO(export(client, headers, 'csv').get_data(as_text = True))))
+    assert len(rows) == 1
+    assert rows[0]['name'] == 'Lovelace, Ada'
+    assert rows[0]['address'] == '1 "Main" Street'
+
+def test_jsonl_export_is_the_default_and_only_has_this_users_contacts(client, user, headers):
+    other = User('grace@example.com', password = 'password')
+    db.session.add(other)
+    db.session.commit()
+    db.session.add_all([
+        Contact('Ada', 'ada@example.com', None, None, user.token),
+        Contact('Grace', 'grace@example.com', None, None, other.token)
+    ])
+    db.session.commit()
+
+    response = client.get('/api/contacts/export', headers = headers)
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text = True).splitlines()]
+    assert [line['name'] for line in lines] == ['Ada']
+    assert set(lines[0]) == {'id', 'name', 'email', 'phone_number', 'address'}
+
+def test_vcard_export_escapes_special_characters(client, user, headers):
+    db.session.add(Contact('Ada; the first\\programmer', 'ada@example.com', '555-0100', 'Main Street, 1\nLondon', user.token))
+    db.session.commit()
+    response = export(client, headers, 'vcf')
+    assert response.mimetype == 'text/vcard'
+
+    lines = response.get_data(as_text = True).split('\r\n')
+    assert lines[0] == 'BEGIN:VCARD'
+    assert 'FN:Ada\\; the first\\\\programmer' in lines
+    assert 'N:Ada\\; the first\\\\programmer;;;;' in lines
+    assert 'ADR:;;Main Street\\, 1\\nLondon;;;;' in lines
+    assert 'TEL:555-0100' in lines
+    assert lines[-2:] == ['END:VCARD', '']
+
+def test_unknown_export_format_is_400(client, user, headers):
+    response = client.get('/api/contacts/export?format=xml', headers = headers)
+    assert response.status_code == 400
+    assert 'jsonl, csv, vcf' in response.get_json()['message']
@@ -0,0 +1,34 @@
+import pytest
+from werkzeug.security import check_password_hash
+
+from app import create_app
+from hashing import PasswordHasher, check_method
+from conftest import TestConfig
+
+# the hashing processes are started by forkserver (or spawn), never forked from a worker that may be holding locks
+def test_hashing_processes_are_not_forked():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', 16, 1, 4, 30)
+    executor = hasher.executor()
+    try:
+        assert executor._mp_context.get_start_method() in ('forkserver', 'spawn')
+        pw_hash = hasher.hash('password')
+        assert check_password_hash(pw_hash, 'password')
+        assert hasher.verify(pw_hash, 'password') is True
+        assert hasher.verify(pw_hash, 'wrong') is False
+    finally:
+        executor.shutdown()
+
+@pytest.mark.parametrize('method', ['pbkdf2:sha256:1000', 'scrypt:1024:8:1'])
+def test_a_fresh_hash_never_needs_rehashing(method):
+    hasher = PasswordHasher(check_method(method), 16, 0, 4, 30)
+    pw_hash = hasher.hash('password')
+    assert hasher.needs_rehash(pw_hash) is False
+    assert PasswordHasher('pbkdf2:sha256:2000', 16, 0, 4, 30).needs_rehash(pw_hash) is True
+
+# without the cost, Werkzeug's hash would never start with the method and every sign in would re-hash the password
+@pytest.mark.parametrize('method', ['pbkdf2', 'pbkdf2:sha256', 'scrypt', 'scrypt:32768', 'pbkdf2:sha256:many', 'sha256'])
+def test_a_method_without_its_cost_is_refused(method):
+    class IncompleteConfig(TestConfig):
+        PASSWORD_HASH_METHOD = method
+    with pytest.raises(ValueError, match = 'must include its cost'):
+        create_app(IncompleteConfig)
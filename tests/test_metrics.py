@@ -0,0 +1,33 @@
+import pytest
+
+from app import create_app
+from config import Config
+from conftest import TestConfig
+
+class MetricsConfig(TestConfig):
+    BLUEPRINTS = ['site', 'auth', 'api', 'metrics']
+    OPERATOR_TOKEN = 'operator-secret'
+
+@pytest.fixture
+def metrics_client():
+    return create_app(MetricsConfig).test_client()
+
+def test_metrics_blueprint_is_opt_in():
+    assert 'metrics' not in Config.BLUEPRINTS
+    assert create_app(TestConfig).test_client().get('/metrics').status_code == 404
+
+def test_metrics_need_the_operator_token(metrics_client, headers):
+    assert metrics_client.get('/metrics').status_code == 401
+    assert metrics_client.get('/metrics', headers = {'Authorization': 'Bearer wrong'}).status_code == 401
+    # a customer's api token is not an operator token
+    assert metrics_client.get('/metrics', headers = {'Authorization': headers['x-access-token']}).status_code == 401
+
+    response = metrics_client.get('/metrics', headers = {'Authorization': 'Bearer operator-secret'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+
+def test_metrics_are_hidden_without_an_operator_token():
+    class NoTokenConfig(MetricsConfig):
+        OPERATOR_TOKEN = None
+    client = create_app(NoTokenConfig).test_client()
+    assert client.get('/metrics', headers = {'Authorization': 'Bearer None'}).status_code == 404
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from cache import FileSystemCache
+
+def test_filesystem_cache_stores_text_in_a_private_directory(tmp_path):
+    cache = FileSystemCache(str(tmp_path / 'pages'), 10, 60)
+    assert os.stat(tmp_path / 'pages').st_mode & 0o777 == 0o700
+
+    cache.set(('page', '/'), '<p>\r\nhello</p>')
+    assert cache.get(('page', '/')) == '<p>\r\nhello</p>'
+    with pytest.raises(TypeError):
+        cache.set(('page', '/'), b'bytes')
+
+def test_filesystem_cache_refuses_a_shared_directory(tmp_path):
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    shared.chmod(0o777)
+    with pytest.raises(RuntimeError):
+        FileSystemCache(str(shared), 10, 60)
+
+def test_profile_fragment_keeps_the_token_out_of_the_cache(app, client, user, tmp_path):
+    app.extensions['caches']['page'] = FileSystemCache(str(tmp_path / 'pages'), 10, 60)
+    client.post('/signin', data = {'email': user.email, 'password': 'password'})
+
+    for visit in range(2):
+        response = client.get('/profile')
+        assert response.status_code == 200
+        assert user.token in response.get_data(as_text = True)
+        assert user.email in response.get_data(as_text = True)
+
+    cached = [path.read_text() for path in (tmp_path / 'pages').iterdir()]
+    assert cached and any(user.email in text for text in cached)
+    assert not any(user.token in text for text in cached)
@@ -0,0 +1,103 @@
+import pytest
+from sqlalchemy import text
+
+import search
+from app import create_app
+from models import db, Contact, User
+from search import PrefixIndex
+from conftest import TestConfig
+
+def add_contacts(user, contacts):
+    db.session.add_all([Contact(name, email, phone_number, None, user.token) for name, email, phone_number in contacts])
+    db.session.commit()
+
+def found(client, headers, query):
+    response = client.get('/api/contacts/search', query_string = {'q': query}, headers = headers)
+    assert response.status_code == 200
+    return [contact['name'] for contact in response.get_json()['contacts']]
+
+@pytest.fixture
+def phonebooks(user):
+    other = User('grace@example.com', password = 'password')
+    db.session.add(other)
+    db.session.commit()
+    add_contacts(user, [
+        ('Ada Lovelace', 'ada@example.com', '+1 (555) 010-0001'),
+        ('Alan Turing', 'alan@example.com', '555.010.0002'),
+        ('Grace Hopper', 'grace@navy.example.com', None)
+    ])
+    # the other user's contacts match the same queries, and must never show up
+    add_contacts(other, [
+        ('Ada Byron', 'byron@example.com', '555-010-0001'),
+        ('Alan Kay', 'kay@example.com', '555-010-0003')
+    ])
+    return user, other
+
+# the FTS5 path is only used for phonebooks bigger than SCAN_ROWS - the same queries must give the same answers on both paths
+@pytest.fixture(params = ['scan', 'fts'])
+def search_path(request, monkeypatch):
+    if request.param == 'fts':
+        monkeypatch.setattr(search, 'SCAN_ROWS', 0)
+    return request.param
+
+def test_search_matches_name_and_email_of_this_user_only(client, headers, phonebooks, search_path):
+    assert found(client, headers, 'ada') == ['Ada Lovelace']
+    assert found(client, headers, 'LOVE') == ['Ada Lovelace']
+    assert found(client, headers, 'navy.example') == ['Grace Hopper']
+    assert found(client, headers, 'example.com') == ['Ada Lovelace', 'Alan Turing', 'Grace Hopper']
+    assert found(client, headers, 'zzz') == []
+
+@pytest.mark.parametrize('query', ['555-010-0001', '(555) 0100001', '5550100001', '+1 555 010 0001', '0100001'])
+def test_search_matches_phone_numbers_in_any_format(client, headers, phonebooks, search_path, query):
+    assert found(client, headers, query) == ['Ada Lovelace']
+
+def test_search_uses_the_fts_table(client, headers, phonebooks, monkeypatch):
+    monkeypatch.setattr(search, 'SCAN_ROWS', 0)
+    monkeypatch.setattr(search, 'search_scan', lambda *args, **kwargs: pytest.fail('searched without the FTS table'))
+    assert found(client, headers, 'lovelace') == ['Ada Lovelace']
+    assert db.session.execute(text("SELECT count(*) FROM contact_search")).scalar() == 5
+
+def test_short_queries_match_prefixes(client, headers, phonebooks, search_path):
+    assert found(client, headers, 'al') == ['Alan Turing']
+    assert found(client, headers, 'ov') == []
+
+# each app keeps its own note of whether its database has the index - a second app on a fresh database must create it again
+def test_every_app_creates_its_own_search_index(app, client, headers, phonebooks, monkeypatch):
+    monkeypatch.setattr(search, 'SCAN_ROWS', 0)
+    assert found(client, headers, 'lovelace') == ['Ada Lovelace']
+
+    other_app = create_app(TestConfig)
+    with other_app.app_context():
+        db.create_all()
+        user = User('linus@example.com', password = 'password')
+        db.session.add(user)
+        db.session.commit()
+        add_contacts(user, [('Linus Torvalds', 'linus@example.com', None)])
+        response = other_app.test_client().get('/api/contacts/search?q=torvalds', headers = {'x-access-token': f'Bearer {user.token}'})
+        assert response.status_code == 200
+        assert [contact['name'] for contact in response.get_json()['contacts']] == ['Linus Torvalds']
+        db.session.remove()
+        db.drop_all()
+
+def test_a_dropped_index_falls_back_to_the_scan_and_is_made_again(client, headers, phonebooks, monkeypatch):
+    monkeypatch.setattr(search, 'SCAN_ROWS', 0)
+    assert found(client, headers, 'lovelace') == ['Ada Lovelace']
+
+    for statement in ['DROP TRIGGER contact_search_insert', 'DROP TRIGGER contact_search_update', 'DROP TRIGGER contact_search_delete', 'DROP TABLE contact_search']:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+    assert found(client, headers, 'lovelace') == ['Ada Lovelace']
+    assert found(client, headers, 'turing') == ['Alan Turing']
+    assert db.session.execute(text("SELECT count(*) FROM contact_search")).scalar() == 5
+
+def test_prefix_index_rebuilds_when_the_version_moves(app, phonebooks):
+    user, other = phonebooks
+    index = PrefixIndex(10, 60)
+    assert [row[1] for row in index.search(user.token, 'ada', 10, 3)] == ['Ada Lovelace']
+    assert [row[1] for row in index.search(user.token, '5550100001', 10, 3)] == ['Ada Lovelace']
+
+    add_contacts(user, [('Ada Palmer', 'palmer@example.com', None)])
+    # same version: the trie isn't read from the database again
+    assert [row[1] for row in index.search(user.token, 'ada', 10, 3)] == ['Ada Lovelace']
+    assert sorted(row[1] for row in index.search(user.token, 'ada', 10, 4)) == ['Ada Lovelace', 'Ada Palmer']
@@ -0,0 +1,60 @@
+from cache import MISSING, token_cache, user_cache
+from models import db, Contact, User, load_user
+
+def test_token_rotation_is_evicted_on_commit(client, user, headers):
+    old_token = user.token
+    assert client.get('/api/contacts', headers = headers).status_code == 200
+    assert token_cache.get(old_token) is not MISSING
+
+    user.token = user.set_token(24)
+    db.session.flush()
+    # flushed but not committed: another request may still see the old row, so the cache keeps it for now
+    assert token_cache.get(old_token) is not MISSING
+
+    db.session.commit()
+    assert token_cache.get(old_token) is MISSING
+    assert client.get('/api/contacts', headers = headers).status_code == 401
+    assert client.get('/api/contacts', headers = {'x-access-token': f'Bearer {user.token}'}).status_code == 200
+
+def test_rollback_keeps_the_cache(client, user, headers):
+    assert client.get('/api/contacts', headers = headers).status_code == 200
+
+    user.token = user.set_token(24)
+    db.session.flush()
+    db.session.rollback()
+
+    assert 'forget_users' not in db.session.info
+    assert token_cache.get(user.token) is not MISSING
+    assert client.get('/api/contacts', headers = headers).status_code == 200
+
+def test_deleted_user_is_evicted(client, user, headers):
+    assert client.get('/api/contacts', headers = headers).status_code == 200
+    user_cache.set(user.id, user.snapshot())
+
+    db.session.delete(user)
+    db.session.commit()
+
+    assert user_cache.get(user.id) is MISSING
+    assert client.get('/api/contacts', headers = headers).status_code == 401
+
+def test_updated_user_is_evicted_from_user_cache(user):
+    user_cache.set(user.id, user.snapshot())
+    user.first_name = 'Ada'
+    db.session.commit()
+    assert user_cache.get(user.id) is MISSING
+
+# the cached snapshot is older than the user the session already holds - it must not be copied over it
+def test_cached_token_does_not_overwrite_the_session_user(client, user, headers):
+    assert client.get('/api/contacts', headers = headers).status_code == 200
+    db.session.add(Contact('Ada', 'ada@example.com', '555-0100', '1 Main Street', user.token))
+    db.session.commit()
+    assert db.session.get(User, user.id).phonebook_version == 1
+
+    assert client.get('/api/contacts', headers = headers).status_code == 200
+    assert db.session.get(User, user.id).phonebook_version == 1
+
+def test_cached_user_does_not_overwrite_the_session_user(user):
+    user_cache.set(user.id, user.snapshot())
+    user.first_name = 'Grace'
+    assert load_user(user.id) is user
+    assert user.first_name == 'Grace'